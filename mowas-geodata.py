@@ -113,6 +113,22 @@ def export_ars(arsdict):
     f_ars.SetWidth(12)
     layer.CreateField(f_ars)
 
+    # Neben den eigentlichen Polygonen legen wir eine kompakte Tabelle mit
+    # Schwerpunkt, Umgrenzungsrechteck und Fläche jedes Gebiets an. Der
+    # Alarmierungsdienst lädt nur diese Tabelle und greift auf die Polygone
+    # erst zu, wenn er sie tatsächlich benötigt.
+    index = ds.CreateLayer('region_index', None, ogr.wkbNone)
+
+    f_ars = ogr.FieldDefn('ARS', ogr.OFTString)
+    f_ars.SetWidth(12)
+    index.CreateField(f_ars)
+    index.CreateField(ogr.FieldDefn('REGION', ogr.OFTInteger64))
+    for name in [ 'X', 'Y', 'XMIN', 'XMAX', 'YMIN', 'YMAX', 'AREA' ]:
+        index.CreateField(ogr.FieldDefn(name, ogr.OFTReal))
+    index.CreateField(ogr.FieldDefn('PARTS', ogr.OFTInteger))
+
+    ds.StartTransaction()
+
     for ars, geoms in arsdict.items():
         # Aus den Einzelteilen ein Multipolygon zusammensetzen
         multipolygon = ogr.Geometry(ogr.wkbMultiPolygon)
@@ -128,8 +144,29 @@ def export_ars(arsdict):
         feature.SetGeometry(multipolygon)
         feature.SetField('ARS', ars)
         layer.CreateFeature(feature)
+        fid = feature.GetFID()
         feature = None
 
+        # Indexeintrag ausgeben
+        centroid = multipolygon.Centroid()
+        xmin, xmax, ymin, ymax = multipolygon.GetEnvelope()
+
+        feature = ogr.Feature(index.GetLayerDefn())
+        feature.SetField('ARS', ars)
+        feature.SetField('REGION', fid)
+        feature.SetField('X', centroid.GetX())
+        feature.SetField('Y', centroid.GetY())
+        feature.SetField('XMIN', xmin)
+        feature.SetField('XMAX', xmax)
+        feature.SetField('YMIN', ymin)
+        feature.SetField('YMAX', ymax)
+        feature.SetField('AREA', multipolygon.GetArea())
+        feature.SetField('PARTS', multipolygon.GetGeometryCount())
+        index.CreateFeature(feature)
+        feature = None
+
+    ds.CommitTransaction()
+
     ds = None
 
 
@@ -12,22 +12,33 @@ from aioax25.aprs.symbol import APRSSymbol
 from aioax25.frame import AX25Address
 import argparse
 import binascii
-import copy
+import bisect
+import collections
+import concurrent.futures
 import datetime
+import hashlib
+import heapq
 import json
 import logging
 import os
 from osgeo import gdal
 from osgeo import ogr
 import pytz
+import queue
 import random
 import re
 import requests
 import serial
 import socket
+import sqlite3
 import sys
+import threading
 import time
-import xmltodict
+import tracemalloc
+import urllib.parse
+import urllib3
+import weakref
+import xml.etree.ElementTree
 import yaml
 
 gdal.UseExceptions()
@@ -73,6 +84,13 @@ parser.add_argument(
     metavar = 'FILE',
     help = "Log-Datei")
 
+parser.add_argument(
+    '--benchmark-cap',
+    type = str,
+    nargs = '+',
+    metavar = 'FILE',
+    help = "Laufzeit und Speicherbedarf des CAP-Parsers für die angegebenen Dateien messen und beenden")
+
 
 ARGS = parser.parse_args()
 
@@ -109,6 +127,15 @@ def parse_duration(s):
 
 
 
+def parse_datetime(s):
+    # Bereits vom CAP-Parser umgewandelte Zeitstempel übernehmen wir direkt.
+    if isinstance(s, datetime.datetime):
+        return s
+
+    return datetime.datetime.fromisoformat(s)
+
+
+
 def parse_ax25addr(s):
     x = s.split('-')
 
@@ -166,6 +193,15 @@ class Config:
         return value
 
 
+    def get_float(self, key, default = None, null = False):
+        value = self._get_value(key, default, null)
+        if value is None and null:
+            return None
+        if isinstance(value, bool) or not isinstance(value, ( int, float )):
+            raise ConfigException("Ungültiges Attribut '%s': Zahl erwartet." % key)
+        return float(value)
+
+
     def get_str(self, key, default = None, null = False):
         value = self._get_value(key, default, null)
         if value is None and null:
@@ -275,11 +311,32 @@ class Config:
 
 
 
+#
+# Kompakter Indexeintrag eines Gebiets: Verweis auf das Feature in der Ebene
+# `region`, Schwerpunkt, Umgrenzungsrechteck, Fläche und Anzahl an
+# Teilflächen.
+#
+GeodataIndex = collections.namedtuple('GeodataIndex', [ 'fid', 'x', 'y', 'xmin', 'xmax', 'ymin', 'ymax', 'area', 'parts' ])
+
+
+
 class Geodata:
     def __init__(self, config):
         self.logger = logging.getLogger('mowas.geodata')
 
-        self.ars = {}
+        self.ds = None
+        self.layer = None
+        self.index = {}
+
+        # Nachgeladene Polygone halten wir in einem größenbeschränkten Cache
+        # vor. Am längsten nicht genutzte Polygone werden zuerst verdrängt.
+        self.cache = collections.OrderedDict()
+        self.cache_size = config.get_int('cache_size', 256)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        if self.cache_size < 0:
+            raise ConfigException("Ungültiges Attribut 'cache_size': Wert darf nicht negativ sein.")
 
         self._load(config.get_str('path', None))
 
@@ -305,6 +362,40 @@ class Geodata:
             self.logger.error("Ebene 'region' in '%s' enthält keine Polygone." % path)
             return
 
+        # Die Polygone selbst laden wir erst bei Bedarf. Deshalb bleibt die
+        # Datei geöffnet.
+        self.ds = ds
+        self.layer = l
+
+        lindex = ds.GetLayer('region_index')
+        if lindex is not None:
+            self._load_index(lindex)
+        else:
+            # Ältere, mit `mowas-geodata.py` erzeugte Dateien enthalten noch
+            # keinen Index. Wir berechnen ihn dann beim Start selbst.
+            self.logger.warning("Ebene 'region_index' in '%s' nicht vorhanden. Index wird berechnet. Die Datei sollte neu erzeugt werden." % path)
+            self._build_index(l)
+
+        self.logger.info("%d Regionen geladen." % len(self.index))
+
+
+    def _load_index(self, l):
+        for f in l:
+            ars = f.ARS
+
+            # Ungültige Regionalschlüssel überspringen
+            if len(ars) != 12:
+                continue
+
+            self.index[ars] = GeodataIndex(
+                f.REGION,
+                f.X, f.Y,
+                f.XMIN, f.XMAX, f.YMIN, f.YMAX,
+                f.AREA,
+                f.PARTS)
+
+
+    def _build_index(self, l):
         for f in l:
             ars = f.ARS
 
@@ -312,13 +403,63 @@ class Geodata:
             if len(ars) != 12:
                 continue
 
-            self.ars[ars] = f.GetGeometryRef().Clone()
+            geom = f.GetGeometryRef()
+            centroid = geom.Centroid()
+            xmin, xmax, ymin, ymax = geom.GetEnvelope()
+            parts = geom.GetGeometryCount() if geom.GetGeometryType() == ogr.wkbMultiPolygon else 1
+
+            self.index[ars] = GeodataIndex(
+                f.GetFID(),
+                centroid.GetX(), centroid.GetY(),
+                xmin, xmax, ymin, ymax,
+                geom.GetArea(),
+                parts)
+
 
-        self.logger.info("%d Regionen geladen." % len(self.ars))
+    def ars_index(self, ars):
+        return self.index.get(ars, None)
 
 
     def ars_get(self, ars):
-        return self.ars.get(ars, None)
+        index = self.index.get(ars, None)
+        if index is None:
+            return None
+
+        geom = self.cache.get(ars, None)
+        if geom is not None:
+            self.cache_hits += 1
+            self.cache.move_to_end(ars)
+            return geom
+
+        self.cache_misses += 1
+
+        geom = self._fetch(ars, index)
+        if geom is None or self.cache_size == 0:
+            return geom
+
+        self.cache[ars] = geom
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last = False)
+
+        self.logger.debug("Polygon '%s' nachgeladen. Cache: %d Einträge, %d Treffer, %d Fehlzugriffe." % ( ars, len(self.cache), self.cache_hits, self.cache_misses ))
+
+        return geom
+
+
+    def _fetch(self, ars, index):
+        f = self.layer.GetFeature(index.fid)
+        if f is None:
+            self.logger.error("Gebiet '%s' nicht in Ebene 'region' vorhanden." % ars)
+            return None
+
+        geom = f.GetGeometryRef().Clone()
+
+        # Einfache Polygone behandeln wir wie ein Multipolygon mit nur einer
+        # Teilfläche.
+        if geom.GetGeometryType() == ogr.wkbPolygon:
+            geom = ogr.ForceToMultiPolygon(geom)
+
+        return geom
 
 
 
@@ -327,17 +468,25 @@ class Alert:
         self.attrs = {}
         self.txstate = {}
 
+        # Seit der letzten Sicherung geänderte Bestandteile: `alert` für den
+        # CAP-Datensatz, `state` für Attribute und Übertragungsstatus.
+        self.dirty = set()
+
+        # Wird bei jeder inhaltlichen Änderung des CAP-Datensatzes erhöht.
+        # Davon abgeleitete Ergebnisse können so zwischengespeichert werden.
+        self.revision = 0
+
         # Datentypen eines CAP-Datensatzes aufbereiten
         if 'sent' in capdata:
-            capdata['sent'] = datetime.datetime.fromisoformat(capdata['sent'])
+            capdata['sent'] = parse_datetime(capdata['sent'])
 
         for i in capdata['info']:
             if 'effective' in i:
-                i['effective'] = datetime.datetime.fromisoformat(i['effective'])
+                i['effective'] = parse_datetime(i['effective'])
             if 'onset' in i:
-                i['onset'] = datetime.datetime.fromisoformat(i['onset'])
+                i['onset'] = parse_datetime(i['onset'])
             if 'expires' in i:
-                i['expires'] = datetime.datetime.fromisoformat(i['expires'])
+                i['expires'] = parse_datetime(i['expires'])
 
         self.capdata = capdata
 
@@ -354,9 +503,17 @@ class Alert:
     def update(self, alert):
         assert self.aid == alert.aid, "Inkompatible Alert-IDs '%s' und '%s' beim Update einer Warnung." % ( self.aid, alert.aid )
 
-        self.capdata = alert.capdata
-        self.attrs.update(alert.attrs)
-        self.txstate.update(alert.txstate)
+        if self.capdata != alert.capdata:
+            self.capdata = alert.capdata
+            self.revision += 1
+            self.dirty.add('alert')
+
+        for key, value in alert.attrs.items():
+            self.attr_set(key, value)
+
+        if alert.txstate:
+            self.txstate.update(alert.txstate)
+            self.dirty.add('state')
 
 
     @property
@@ -382,7 +539,9 @@ class Alert:
 
 
     def attr_set(self, key, value):
-        self.attrs[key] = value
+        if self.attrs.get(key, None) != value:
+            self.attrs[key] = value
+            self.dirty.add('state')
 
 
     def attr_get(self, key):
@@ -409,26 +568,315 @@ class Alert:
         if tname not in self.txstate[ttype]:
             self.txstate[ttype][tname] = { 'first': t }
         self.txstate[ttype][tname]['last'] = t
+        self.dirty.add('state')
+
+
+
+#
+# Einlesen eines CAP-Datensatzes im XML-Format. Die Datei wird schrittweise
+# verarbeitet und bereits abgearbeitete XML-Elemente werden sofort wieder
+# freigegeben. Das Ergebnis hat die selbe Struktur wie die JSON-Datensätze des
+# BBK:
+#
+#  * Elemente, die laut CAP-Spezifikation mehrfach auftreten können, werden
+#    stets als Liste abgebildet, auch wenn sie nur einmal vorkommen.
+#  * Zeitstempel werden direkt in `datetime`-Objekte umgewandelt.
+#  * Eingebettete Nutzdaten von Ressourcen (`derefUri`) werden verworfen, da
+#    wir sie nicht benötigen.
+#
+CAP_LISTS = \
+{
+    'alert':    { 'code', 'info' },
+    'info':     { 'category', 'responseType', 'eventCode', 'parameter', 'resource', 'area' },
+    'area':     { 'polygon', 'circle', 'geocode' },
+}
+
+CAP_DATES = \
+{
+    'alert':    { 'sent' },
+    'info':     { 'effective', 'onset', 'expires' },
+}
+
+CAP_SKIP = \
+{
+    'resource': { 'derefUri' },
+}
+
+
+def parse_cap_xml(path):
+    stack = []
+    capdata = None
+
+    for event, elem in xml.etree.ElementTree.iterparse(path, events = ( 'start', 'end' )):
+        # Namensraum verwerfen
+        tag = elem.tag.rpartition('}')[2]
+
+        if event == 'start':
+            stack.append(( tag, {} ))
+            continue
+
+        tag, children = stack.pop()
+
+        if len(children) > 0:
+            value = children
+        else:
+            value = elem.text.strip() if elem.text is not None else ''
+            if value == '':
+                value = None
+
+        # Verarbeitetes Element freigeben
+        elem.clear()
+
+        if len(stack) == 0:
+            if tag != 'alert':
+                raise ValueError("Unerwartetes Wurzelelement '%s' in CAP-Datensatz '%s'." % ( tag, path ))
+            capdata = value if isinstance(value, dict) else {}
+            break
+
+        parent, siblings = stack[-1]
+
+        if tag in CAP_SKIP.get(parent, set()):
+            continue
+
+        if tag in CAP_DATES.get(parent, set()) and value is not None:
+            value = datetime.datetime.fromisoformat(value)
+
+        if tag in CAP_LISTS.get(parent, set()):
+            siblings.setdefault(tag, []).append(value)
+        elif tag in siblings:
+            # Unbekannte, mehrfach auftretende Elemente fassen wir ebenfalls
+            # als Liste zusammen.
+            if not isinstance(siblings[tag], list):
+                siblings[tag] = [ siblings[tag] ]
+            siblings[tag].append(value)
+        else:
+            siblings[tag] = value
+
+    if capdata is None:
+        raise ValueError("CAP-Datensatz '%s' ist unvollständig." % path)
+
+    capdata.setdefault('info', [])
+
+    return capdata
+
+
+
+#
+# Vergleich des CAP-Parsers mit dem bisherigen Verfahren über `xmltodict`.
+# Das Paket `xmltodict` wird nur hierfür benötigt und ist optional.
+#
+def benchmark_cap(paths, rounds = 20):
+    def parse_xmltodict(path):
+        with open(path) as f:
+            capdata = xmltodict.parse(f.read())
+        capdata = capdata['alert']
+        del capdata['@xmlns']
+
+        if 'info' in capdata and not isinstance(capdata['info'], list):
+            capdata['info'] = [ capdata['info'] ]
+        for i in capdata['info']:
+            if 'resource' in i and not isinstance(i['resource'], list):
+                i['resource'] = [ i['resource'] ]
+            if 'area' in i and not isinstance(i['area'], list):
+                i['area'] = [ i['area'] ]
+
+        return Alert(capdata)
+
+    def parse_iterparse(path):
+        return Alert(parse_cap_xml(path))
+
+    parsers = [ ( 'iterparse', parse_iterparse ) ]
+    try:
+        import xmltodict
+        parsers.insert(0, ( 'xmltodict', parse_xmltodict ))
+    except ImportError:
+        print("Paket 'xmltodict' nicht installiert. Vergleichsmessung entfällt.")
+
+    for path in paths:
+        print("%s (%d Bytes)" % ( path, os.path.getsize(path) ))
+
+        for name, parse in parsers:
+            tracemalloc.start()
+            parse(path)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            t = time.perf_counter()
+            for i in range(rounds):
+                parse(path)
+            t = (time.perf_counter() - t) / rounds
+
+            print("  %-10s %10.3f ms %10d Bytes Spitzenspeicher" % ( name, t * 1000, peak ))
+
+
+
+#
+# Zustand bedingter HTTP-Abrufe je URL: ETag, Last-Modified und ein Hash des
+# zuletzt geladenen Inhalts. Er wird neben dem Cache gespeichert, damit auch
+# der erste Abruf nach einem Neustart mit `304 Not Modified` beantwortet werden
+# kann. Da die Quellen parallel abgerufen werden, ist der Zugriff durch eine
+# Sperre geschützt.
+#
+# Neue Validatoren werden erst übernommen, wenn die zugehörigen Warnungen im
+# Cache gespeichert sind. Bricht das Programm vorher ab, wird der Inhalt nach
+# dem Neustart erneut abgerufen, statt als unverändert übergangen zu werden.
+#
+class HttpState:
+    def __init__(self, path, load = True):
+        self.logger = logging.getLogger('mowas.http')
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.urls = {}
+
+        # Ohne Warnungen im Cache verwerfen wir den Zustand. Sonst würden
+        # unveränderte Inhalte nach dem Verlust des Caches nie wieder
+        # eingelesen.
+        if not load:
+            return
+
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                try:
+                    self.urls = json.load(f)
+                except json.decoder.JSONDecodeError as e:
+                    self.logger.error("Fehler beim Laden von '%s'." % self.path)
+                    self.logger.exception(e)
+
+
+    def get(self, url):
+        with self.lock:
+            return dict(self.urls.get(url, {}))
+
+
+    def update(self, states):
+        with self.lock:
+            if all(self.urls.get(url, None) == state for url, state in states.items()):
+                return
+
+            self.urls.update(states)
+
+            path_tmp = self.path + '.tmp'
+            with open(path_tmp, 'w') as f:
+                json.dump(self.urls, f)
+            os.replace(path_tmp, self.path)
 
 
 
 class Source:
-    def __init__(self, sname):
+    def __init__(self, sname, config):
         self.sname = sname
         self.logger = logging.getLogger('mowas.source.%s.%s' % ( self.stype, self.sname ))
 
-        self._etag_cache = {}
+        # Zeitlimit für einen Abruf in Sekunden. Quellen, die länger
+        # benötigen, werden im aktuellen Durchlauf übergangen.
+        self.deadline = config.get_float('deadline', 30)
+        if self.deadline <= 0:
+            raise ConfigException("Ungültiges Attribut 'deadline': Wert muss positiv sein.")
+
+        self.session = None
+        self.http_timeout = None
+        self._http_staged = {}
+
+
+    #
+    # Quellen, die Daten per HTTP(S) abrufen, nutzen eine gemeinsame Sitzung.
+    # Die Verbindungen zum Server bleiben so zwischen zwei Abrufen bestehen
+    # und es entfällt jedes Mal der Verbindungsaufbau.
+    #
+    # Fehlgeschlagene Abrufe werden mit zunehmender Wartezeit wiederholt. Alle
+    # Versuche samt Wartezeiten müssen dabei in das Zeitlimit der Quelle
+    # passen. Ohne Angabe wird `timeout` daher aus `deadline` bemessen, sonst
+    # wird die Anzahl der Wiederholungen ggf. reduziert. Eine vom Server per
+    # `Retry-After` verlangte Wartezeit ignorieren wir, da sie das Zeitlimit
+    # beliebig überschreiten kann. `timeout` begrenzt dabei jeweils den
+    # Verbindungsaufbau und die Wartezeit auf weitere Daten, nicht die Dauer
+    # des gesamten Abrufs. Quellen mit mehreren
+    # Download-Quellen wiederholen nicht, da sie stattdessen die nächste
+    # Download-Quelle anfragen.
+    #
+    def _http_init(self, config, retries = True):
+        http_pool_size = config.get_int('pool_size', 4)
+
+        if http_pool_size < 1:
+            raise ConfigException("Ungültiges Attribut 'pool_size': Wert muss positiv sein.")
+
+        if retries:
+            http_retries = config.get_int('retries', 3)
+            http_backoff = config.get_float('backoff', 0.5)
+
+            if http_retries < 0:
+                raise ConfigException("Ungültiges Attribut 'retries': Wert darf nicht negativ sein.")
+            if http_backoff < 0:
+                raise ConfigException("Ungültiges Attribut 'backoff': Wert darf nicht negativ sein.")
+            if self._http_budget(http_retries, http_backoff) <= 0:
+                raise ConfigException("Ungültiges Attribut 'backoff': Wartezeiten zwischen den Wiederholungen überschreiten 'deadline'.")
+
+            self.http_timeout = config.get_float('timeout', self._http_budget(http_retries, http_backoff) / (http_retries + 1))
+        else:
+            http_retries = 0
+            self.http_timeout = config.get_float('timeout', 30)
+
+        if self.http_timeout <= 0:
+            raise ConfigException("Ungültiges Attribut 'timeout': Wert muss positiv sein.")
+
+        if retries:
+            fit = http_retries
+            while fit > 0 and (fit + 1) * self.http_timeout > self._http_budget(fit, http_backoff):
+                fit -= 1
+
+            if fit < http_retries:
+                self.logger.warning("%d Versuche mit je %g Sekunden überschreiten das Zeitlimit von %g Sekunden. Reduziere auf %d Wiederholung(en)." % ( http_retries + 1, self.http_timeout, self.deadline, fit ))
+                http_retries = fit
+
+            retry = urllib3.util.Retry(
+                total = http_retries,
+                backoff_factor = http_backoff,
+                status_forcelist = [ 429, 500, 502, 503, 504 ],
+                allowed_methods = [ 'GET' ],
+                raise_on_status = False,
+                respect_retry_after_header = False)
+        else:
+            retry = 0
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections = http_pool_size,
+            pool_maxsize = http_pool_size,
+            max_retries = retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
 
+    #
+    # Zeit, die nach Abzug der Wartezeiten zwischen den Wiederholungen für die
+    # eigentlichen Versuche bleibt. Vor der ersten Wiederholung wird nicht
+    # gewartet, danach verdoppelt sich die Wartezeit ausgehend von `backoff`.
+    #
+    def _http_budget(self, retries, backoff):
+        return self.deadline - sum(backoff * 2 ** (i - 1) for i in range(2, retries + 1))
 
+
+    #
+    # Bedingter Abruf von `url`. Zurückgegeben werden die Antwort, sofern sich
+    # der Inhalt geändert hat, und die neuen Validatoren. Der Aufrufer merkt
+    # die Validatoren erst vor, wenn er den Inhalt verarbeiten konnte. Sie
+    # werden übernommen, wenn die Warnungen im Cache gespeichert sind.
+    #
     def fetch_etag(self, url):
+        state = HTTP_STATE.get(url)
+
         headers = {}
-        if url in self._etag_cache:
-            headers['If-None-Match'] = self._etag_cache[url]
+        if state.get('etag', None) is not None:
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified', None) is not None:
+            headers['If-Modified-Since'] = state['last_modified']
 
-        r = requests.get(url, headers = headers)
         try:
+            r = self.session.get(url, headers = headers, timeout = self.http_timeout)
             r.raise_for_status()
-        except requests.exceptions.HTTPError as e:
+        except requests.exceptions.RequestException as e:
             self.logger.warning("Fehler beim Download von '%s'." % url)
             self.logger.exception(e)
             raise
@@ -436,14 +884,54 @@ class Source:
         if r.status_code == 304:
             # Wir sind bereits dem neusten Stand
             self.logger.debug("Inhalt von '%s' hat sich nicht geändert." % url)
-            return None
+            return None, None
 
         self.logger.debug("Download von '%s' erfolgreich." % url)
 
-        # Aktuelles ETag im Cache vermerken
-        self._etag_cache[url] = r.headers['ETag']
+        # Aktuelle Validatoren und den Hash des Inhalts bestimmen
+        content_hash = hashlib.sha256(r.content).hexdigest()
+        state_new = \
+        {
+            'etag':          r.headers.get('ETag', None),
+            'last_modified': r.headers.get('Last-Modified', None),
+            'hash':          content_hash,
+        }
+
+        # Manche Server ignorieren bedingte Abrufe. Einen unveränderten Inhalt
+        # erkennen wir dann am Hash und lesen ihn nicht erneut ein.
+        if state.get('hash', None) == content_hash:
+            self.logger.debug("Inhalt von '%s' ist unverändert." % url)
+            return None, state_new
+
+        return r, state_new
+
 
-        return r
+    #
+    # Der Abruf erfolgt in einem eigenen Thread. Jede Warnung wird über
+    # `results` an den Hauptthread übergeben, sobald sie vorliegt, damit sie
+    # ohne Warten auf den übrigen Abruf in den Cache übernommen und alarmiert
+    # werden kann. Ein abschließender Eintrag ohne Warnung markiert das Ende
+    # des Abrufs. Zurückgegeben werden die neuen HTTP-Validatoren des Abrufs,
+    # die der Hauptthread nach dem Speichern des Caches übernimmt.
+    #
+    def poll(self, results):
+        self._http_staged = {}
+
+        try:
+            for alert in self.fetch():
+                results.put(( self, alert ))
+        finally:
+            results.put(( self, None ))
+
+        return self._http_staged
+
+
+    #
+    # Wird im Hauptthread aufgerufen, nachdem eine Warnung erfolgreich in den
+    # Cache übernommen wurde.
+    #
+    def merged(self, alert):
+        pass
 
 
     def purge(self, valid):
@@ -456,7 +944,7 @@ class SourceDARC(Source):
 
 
     def __init__(self, sname, config):
-        super().__init__(sname)
+        super().__init__(sname, config)
 
         self.dir_json  = config.get_str('dir_json')
         self.dir_cap   = config.get_str('dir_cap')
@@ -464,10 +952,46 @@ class SourceDARC(Source):
 
         self.fetch_internet = config.get_bool('fetch_internet', False)
         self.fetch_hamnet   = config.get_bool('fetch_hamnet',   False)
+        self.downloads      = config.get_int('downloads', 4)
+        self.hedge_delay    = config.get_float('hedge_delay', 0)
 
         if not self.fetch_internet and not self.fetch_hamnet:
             raise ConfigException("Quelle 'DARC', Parameter 'fetch': Mind. eine Download-Quelle muss aktiviert sein.")
 
+        if self.downloads < 1:
+            raise ConfigException("Quelle 'DARC', Parameter 'downloads': Mind. ein Download muss möglich sein.")
+
+        if self.hedge_delay < 0:
+            raise ConfigException("Quelle 'DARC', Parameter 'hedge_delay': Wert darf nicht negativ sein.")
+
+        # Antwortzeiten und Fehler je Server, um die Reihenfolge der
+        # Download-Quellen festzulegen.
+        self._mirror_stats = {}
+        self._mirror_lock = threading.Lock()
+
+        # Die einzelnen Anfragen an die Download-Quellen laufen in einem
+        # eigenen Pool, der die Anzahl gleichzeitiger Downloads begrenzt.
+        # Zusätzliche Anfragen nach `hedge_delay` erhalten ein eigenes
+        # Kontingent. Sonst müssten sie ggf. warten, bis Anfragen an einen
+        # nicht erreichbaren Server nach `timeout` aufgeben, und würden keinen
+        # Zeitgewinn bringen.
+        self._download_pool = concurrent.futures.ThreadPoolExecutor(max_workers = self.downloads, thread_name_prefix = 'darc-download')
+        self._hedge_pool = None
+        if self.hedge_delay > 0:
+            self._hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers = self.downloads, thread_name_prefix = 'darc-hedge')
+
+        # Bereits eingelesene Alarmierungs- und CAP-Files. Anhand von
+        # Änderungszeitpunkt, Größe und Inode erkennen wir, ob eine Datei
+        # erneut eingelesen werden muss.
+        self._json_index = {}
+        self._cap_index = {}
+
+        # Indexeinträge zu weitergegebenen, vollständigen Warnungen. Sie gelten
+        # erst als verarbeitet, wenn die Warnung im Cache angekommen ist.
+        self._complete = {}
+
+        self._http_init(config, retries = False)
+
         if not os.path.isdir(self.dir_json):
             raise ConfigException("Quelle 'DARC', Parameter 'dir_json': '%s' ist kein Verzeichnis" % self.dir_json)
 
@@ -478,7 +1002,19 @@ class SourceDARC(Source):
             raise ConfigException("Quelle 'DARC', Parameter 'dir_audio': '%s' ist kein Verzeichnis" % self.dir_audio)
 
 
+    def _stat_key(self, st):
+        return ( st.st_mtime_ns, st.st_size, st.st_ino )
+
+
+    #
+    # Liefert alle Alarmierungs-Files samt zugehörigem Indexeintrag. Die
+    # Dateien werden nur eingelesen, wenn sie neu sind oder sich geändert
+    # haben. Ein Indexeintrag enthält die Alarmierung (`alert`) und vermerkt,
+    # ob sie bereits vollständig verarbeitet wurde (`done`).
+    #
     def _read_alert(self):
+        index = {}
+
         with os.scandir(self.dir_json) as it:
             for entry in it:
                 if not entry.is_file():
@@ -488,35 +1024,54 @@ class SourceDARC(Source):
                 if ext != '.json':
                     continue
 
-                with open(entry) as f:
-                    try:
-                        darc_alert = json.load(f)
-                    except json.decoder.JSONDecodeError:
-                        self.logger.error("Fehler beim Laden der Warnung '%s'." % entry)
-                        self.logger.exception(e)
-                        continue
+                key = self._stat_key(entry.stat())
 
-                yield entry.path, darc_alert
+                record = self._json_index.get(entry.path, None)
+                if record is None or record['stat'] != key:
+                    record = { 'stat': key, 'alert': None, 'done': False }
 
+                    with open(entry) as f:
+                        try:
+                            record['alert'] = json.load(f)
+                        except json.decoder.JSONDecodeError as e:
+                            self.logger.error("Fehler beim Laden der Warnung '%s'." % entry.path)
+                            self.logger.exception(e)
 
-    def _read_cap(self, path):
-        if not os.path.isfile(path):
+                index[entry.path] = record
+
+                # Fehlerhafte Files lesen wir erst nach einer Änderung erneut
+                # ein.
+                if record['alert'] is None:
+                    continue
+
+                yield entry.path, record
+
+        # Gelöschte Files vergessen
+        self._json_index = index
+
+
+    def _read_cap_aid(self, path):
+        try:
+            key = self._stat_key(os.stat(path))
+        except FileNotFoundError:
+            self._cap_index.pop(path, None)
             return None
 
-        with open(path) as f:
-            capdata = xmltodict.parse(f.read())
-        capdata = capdata['alert']
-        del capdata['@xmlns']
+        cached = self._cap_index.get(path, None)
+        if cached is not None and cached[0] == key:
+            return cached[1]
 
-        if 'info' in capdata and not isinstance(capdata['info'], list):
-            capdata['info'] = [ capdata['info'] ]
-        for i in capdata['info']:
-            if 'resource' in i and not isinstance(i['resource'], list):
-                i['resource'] = [ i['resource'] ]
-            if 'area' in i and not isinstance(i['area'], list):
-                i['area'] = [ i['area'] ]
+        alert = self._read_cap(path)
+        self._cap_index[path] = ( key, alert.aid )
 
-        return Alert(capdata)
+        return alert.aid
+
+
+    def _read_cap(self, path):
+        if not os.path.isfile(path):
+            return None
+
+        return Alert(parse_cap_xml(path))
 
 
     def _safe_filename(self, filename):
@@ -535,64 +1090,258 @@ class SourceDARC(Source):
         return os.path.join(self.dir_audio, self._safe_filename("%s.wav" % aid))
 
 
+    #
+    # Heruntergeladene Daten werden zunächst in eine temporäre Datei
+    # geschrieben, die erst nach vollständigem Download umbenannt wird. So
+    # liegt unter dem endgültigen Namen nie eine unvollständige Datei vor. Die
+    # Daten werden dabei blockweise geschrieben und nicht vollständig im
+    # Speicher gehalten.
+    #
+    # Laufen mehrere Downloads derselben Datei parallel, gewinnt der zuerst
+    # abgeschlossene. Alle anderen werden abgebrochen, sobald `done` gesetzt
+    # ist.
+    #
+    def _write_file(self, path, r, attempt, done, lock):
+        path_tmp = '%s.%d.part' % ( path, attempt )
+
+        try:
+            with open(path_tmp, 'wb') as f:
+                for chunk in r.iter_content(chunk_size = 65536):
+                    if done.is_set():
+                        break
+                    f.write(chunk)
+
+            with lock:
+                if done.is_set():
+                    os.unlink(path_tmp)
+                    return False
+
+                os.replace(path_tmp, path)
+                done.set()
+                return True
+        except BaseException:
+            if os.path.isfile(path_tmp):
+                os.unlink(path_tmp)
+            raise
+
+
+    def _mirror_key(self, url):
+        return urllib.parse.urlsplit(url).netloc
+
+
+    #
+    # Server, die zuletzt fehlerfrei und schnell geantwortet haben, werden
+    # zuerst abgefragt. Noch unbekannte Server werden bevorzugt, damit für
+    # sie Messwerte entstehen. Bei Gleichstand entscheidet der Zufall.
+    #
+    def _mirror_order(self, urls):
+        with self._mirror_lock:
+            keys = {}
+            for url in urls:
+                stats = self._mirror_stats.get(self._mirror_key(url), { 'errors': 0, 'latency': 0.0 })
+                keys[url] = ( stats['errors'], stats['latency'], random.random() )
+
+        return sorted(urls, key = lambda url: keys[url])
+
+
+    def _mirror_update(self, url, latency):
+        with self._mirror_lock:
+            stats = self._mirror_stats.setdefault(self._mirror_key(url), { 'errors': 0, 'latency': 0.0 })
+
+            if latency is None:
+                # Fehlerhafte Server werden mit jedem Fehler weiter
+                # zurückgestellt.
+                stats['errors'] += 1
+            elif stats['latency'] == 0.0:
+                stats['errors'] = 0
+                stats['latency'] = latency
+            else:
+                # Gleitender Mittelwert der Antwortzeit
+                stats['errors'] = 0
+                stats['latency'] = 0.7 * stats['latency'] + 0.3 * latency
+
+
+    def _fetch_url(self, path, url, attempt, done, lock, results):
+        # Eine zusätzliche Anfrage kann im Pool gewartet haben, bis eine
+        # andere den Download bereits abgeschlossen hat.
+        if done.is_set():
+            results.put(False)
+            return
+
+        self.logger.debug("Download von '%s'." % url)
+        try:
+            with self.session.get(url, timeout = self.http_timeout, stream = True) as r:
+                r.raise_for_status()
+                self._mirror_update(url, r.elapsed.total_seconds())
+                success = self._write_file(path, r, attempt, done, lock)
+        except Exception as e:
+            self._mirror_update(url, None)
+            self.logger.warning("Fehler beim Download von '%s'." % url)
+            self.logger.exception(e)
+            success = False
+
+        if success:
+            self.logger.debug("Download von '%s' erfolgreich." % url)
+
+        results.put(success)
+
+
+    #
+    # Die Download-Quellen werden nacheinander abgefragt. Ist `hedge_delay`
+    # gesetzt und liegt nach dieser Zeit noch keine Antwort vor, wird
+    # zusätzlich die nächste Quelle angefragt. Es gewinnt die Quelle, die den
+    # Download zuerst abschließt.
+    #
     def _fetch_file(self, path, urls):
         # Nichts tun, wenn File bereits existiert
         if os.path.isfile(path):
             self.logger.debug("Datei '%s' bereit vorhanden. Download nicht notwendig." % path)
             return True
 
-        # URLs in zufälliger Reihenfolge abfragen
-        random.shuffle(urls)
-        for url in urls:
-            self.logger.debug("Download von '%s'." % url)
-            r = requests.get(url)
+        urls = self._mirror_order(urls)
+
+        done = threading.Event()
+        lock = threading.Lock()
+        results = queue.Queue()
+
+        attempt = 0
+        running = 0
+        while True:
+            if attempt < len(urls) and (running == 0 or self.hedge_delay > 0):
+                if running > 0:
+                    self.logger.debug("Keine Antwort nach %g Sekunden. Frage zusätzlich '%s' an." % ( self.hedge_delay, urls[attempt] ))
+
+                pool = self._hedge_pool if running > 0 else self._download_pool
+                pool.submit(self._fetch_url, path, urls[attempt], attempt, done, lock, results)
+                attempt += 1
+                running += 1
+
+            if running == 0:
+                break
+
+            hedge = attempt < len(urls) and self.hedge_delay > 0
             try:
-                r.raise_for_status()
-            except requests.exceptions.HTTPError as e:
-                self.logger.warning("Fehler beim Download von '%s'." % url)
-                self.logger.exception(e)
+                success = results.get(timeout = self.hedge_delay if hedge else None)
+            except queue.Empty:
                 continue
 
-            self.logger.debug("Download von '%s' erfolgreich." % url)
-            with open(path, 'wb') as f:
-                f.write(r.content)
-
-            return True
+            running -= 1
+            if success:
+                return True
 
         self.logger.warning("Download von '%s' nicht möglich." % path)
 
         return False
 
 
-    def fetch(self):
-        for path_json, darc_alert in self._read_alert():
-            path_cap = self._path_cap(darc_alert['id'])
-            path_audio = self._path_audio(darc_alert['id'])
+    def _urls(self, darc_alert, kind):
+        urls = []
+        if self.fetch_internet:
+            urls.extend(darc_alert['url'][kind]['internet'])
+        if self.fetch_hamnet:
+            urls.extend(darc_alert['url'][kind]['hamnet'])
 
-            sources_cap = []
-            if self.fetch_internet:
-                sources_cap.extend(darc_alert['url']['xml']['internet'])
-            if self.fetch_hamnet:
-                sources_cap.extend(darc_alert['url']['xml']['hamnet'])
+        return urls
 
-            if not self._fetch_file(path_cap, sources_cap):
-                # Ohne CAP-Daten können wir nicht weiter arbeiten.
-                self.logger.warning("Warnung '%s' kann nicht verarbeitet werden, da keine CAP-Daten vorliegen." % path_json)
-                continue
 
-            alert = self._read_cap(path_cap)
+    #
+    # Die CAP- und Audio-Dateien aller anstehenden Warnungen werden parallel
+    # heruntergeladen. Die CAP-Dateien werden dabei zuerst eingeplant. Eine
+    # Warnung wird weitergegeben, sobald ihr CAP-Datensatz vorliegt, ohne auf
+    # die Audio-Datei zu warten. Liegt die Audio-Datei erst später vor, wird
+    # die Warnung mit ihr erneut weitergegeben. Jede Datei wird dabei nur
+    # einmal heruntergeladen, auch wenn mehrere Alarmierungs-Files auf sie
+    # verweisen.
+    #
+    def fetch(self):
+        pending = []
+        downloads = {}
+
+        # Warnungen des vorherigen Abrufs, die nicht in den Cache übernommen
+        # wurden, gelten weiterhin als unverarbeitet und werden erneut
+        # weitergegeben.
+        self._complete = {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers = self.downloads, thread_name_prefix = 'darc') as pool:
+            for path_json, record in self._read_alert():
+                # Vollständig verarbeitete Warnungen liegen bereits im Cache.
+                if record['done']:
+                    continue
 
-            if path_audio is not None:
-                sources_audio = []
-                if self.fetch_internet:
-                    sources_audio.extend(darc_alert['url']['audio']['internet'])
-                if self.fetch_hamnet:
-                    sources_audio.extend(darc_alert['url']['audio']['hamnet'])
+                darc_alert = record['alert']
+                path_cap = self._path_cap(darc_alert['id'])
+                path_audio = self._path_audio(darc_alert['id'])
+
+                if path_cap not in downloads:
+                    downloads[path_cap] = pool.submit(self._fetch_file, path_cap, self._urls(darc_alert, 'xml'))
+
+                pending.append(( path_json, record, path_cap, path_audio ))
+
+            for path_json, record, path_cap, path_audio in pending:
+                if path_audio is None or path_audio in downloads:
+                    continue
+
+                downloads[path_audio] = pool.submit(self._fetch_file, path_audio, self._urls(record['alert'], 'audio'))
+
+            waiting = {}
+            for path_json, record, path_cap, path_audio in pending:
+                waiting.setdefault(downloads[path_cap], []).append(( path_json, record, path_cap, path_audio ))
+                if path_audio is not None:
+                    waiting.setdefault(downloads[path_audio], []).append(( path_json, record, path_cap, path_audio ))
+
+            # Bereits ausgewertete Downloads und weitergegebene Warnungen
+            finished = set()
+            parsed = set()
+
+            for future in concurrent.futures.as_completed(waiting):
+                finished.add(future)
+
+                for path_json, record, path_cap, path_audio in waiting[future]:
+                    try:
+                        if future is downloads[path_cap]:
+                            if not future.result():
+                                # Ohne CAP-Daten können wir nicht weiter arbeiten.
+                                self.logger.warning("Warnung '%s' kann nicht verarbeitet werden, da keine CAP-Daten vorliegen." % path_json)
+                                continue
+
+                            key = self._stat_key(os.stat(path_cap))
+                            alert = self._read_cap(path_cap)
+                            self._cap_index[path_cap] = ( key, alert.aid )
+                            parsed.add(path_json)
+                        elif path_json in parsed:
+                            # Die Warnung wurde bereits ohne Audio-Datei
+                            # weitergegeben. Fehlt die Audio-Datei, versuchen
+                            # wir den Download im nächsten Durchlauf erneut.
+                            if not future.result():
+                                continue
+
+                            alert = self._read_cap(path_cap)
+                        else:
+                            # Die Audio-Datei wird mit dem CAP-Datensatz
+                            # übernommen, sobald dieser vorliegt.
+                            continue
+
+                        # Liegt die Audio-Datei bereits vor, wird sie gleich
+                        # mit übernommen.
+                        complete = path_audio is None
+                        if not complete and downloads[path_audio] in finished and downloads[path_audio].result():
+                            alert.attr_set('path_audio', path_audio)
+                            complete = True
+                    except Exception as e:
+                        self.logger.error("Fehler beim Verarbeiten der Warnung '%s'." % path_json)
+                        self.logger.exception(e)
+                        continue
+
+                    if complete:
+                        self._complete[alert] = record
 
-                if self._fetch_file(path_audio, sources_audio):
-                    alert.attr_set('path_audio', path_audio)
+                    yield alert
 
-            yield alert
+
+    def merged(self, alert):
+        record = self._complete.pop(alert, None)
+        if record is not None:
+            record['done'] = True
 
 
     def purge(self, valid):
@@ -602,11 +1351,18 @@ class SourceDARC(Source):
         files_remove = set()
 
         # Alle Files einlesen
-        for path_json, darc_alert in self._read_alert():
+        paths_cap = set()
+        for path_json, record in self._read_alert():
+            darc_alert = record['alert']
             path_cap = self._path_cap(darc_alert['id'])
             path_audio = self._path_audio(darc_alert['id'])
 
-            alert = self._read_cap(path_cap)
+            paths_cap.add(path_cap)
+            aid = self._read_cap_aid(path_cap)
+
+            # Das Alarmierungs-File selbst behalten wir zunächst. Es kann im
+            # selben Verzeichnis wie die CAP- und Audio-Files liegen.
+            files_keep.add(path_json)
 
             # Warnungen überspringen, zu denen wir keinen CAP-Datensatz
             # vorliegen haben. Der CAP-Datensatz kann z.B. durch einen
@@ -614,13 +1370,14 @@ class SourceDARC(Source):
             # das Alarmierungs-File löschen, würde es im nächsten Durchlauf
             # keinen Versuch mehr geben, den CAP-Datensatz erneut
             # herunterzuladen.
-            if alert is None:
+            if aid is None:
                 self.logger.debug("Behalte '%s', da kein CAP-Datensatz vorliegt." % path_json)
                 continue
 
             # Alte Alarmierungs-Files zur Löschung vormerken.
-            if alert.aid not in valid:
+            if aid not in valid:
                 self.logger.info("Markiere '%s' zu Löschung, da Meldung aus Cache gelöscht wurde." % path_json)
+                files_keep.discard(path_json)
                 files_remove.add(path_json)
                 continue
 
@@ -650,6 +1407,9 @@ class SourceDARC(Source):
             self.logger.info("Lösche '%s'." % path)
             os.unlink(path)
 
+        # Nicht mehr benötigte Indexeinträge verwerfen
+        self._cap_index = { path: v for path, v in self._cap_index.items() if path in paths_cap and path not in files_remove }
+
 
 
 class SourceBBKFile(Source):
@@ -657,7 +1417,7 @@ class SourceBBKFile(Source):
 
 
     def __init__(self, sname, config):
-        super().__init__(sname)
+        super().__init__(sname, config)
 
         self.path = config.get_str('path')
 
@@ -681,19 +1441,23 @@ class SourceBBKUrl(Source):
 
 
     def __init__(self, sname, config):
-        super().__init__(sname)
+        super().__init__(sname, config)
 
         self.url = config.get_str('url')
 
+        self._http_init(config)
+
 
     def fetch(self):
         try:
-            r = self.fetch_etag(self.url)
-        except requests.exceptions.HTTPError:
+            r, state = self.fetch_etag(self.url)
+        except requests.exceptions.RequestException:
             return []
 
         # Kein Download, weil der Cache bereits auf dem aktuellsten Stand ist.
         if r is None:
+            if state is not None:
+                self._http_staged[self.url] = state
             return []
 
         try:
@@ -703,19 +1467,77 @@ class SourceBBKUrl(Source):
             self.logger.exception(e)
             return []
 
+        # Erst jetzt vormerken. Ein fehlerhafter Inhalt würde sonst nach dem
+        # Speichern des Caches als unverändert übergangen.
+        self._http_staged[self.url] = state
+
         for alertdata in capdata:
             yield Alert(alertdata)
 
 
 
-class Cache:
-    def __init__(self, config):
-        self.logger = logging.getLogger('mowas.cache')
+#
+# IDs der Warnungen, auf die eine Warnung verweist. Verweise haben laut
+# CAP-Spezifikation die Form `sender,identifier,sent` und werden durch
+# Leerzeichen getrennt.
+#
+def alert_references(alert):
+    if 'references' not in alert.capdata:
+        return []
+
+    aids = []
+    for ref in alert.capdata['references'].split():
+        ref_sender, ref_aid, ref_sent = ref.split(',')
+        aids.append(ref_aid)
+
+    return aids
+
+
+
+#
+# Der Cache wird als Momentaufnahme (`path`) und als Journal (`path` mit Endung
+# `.journal`) gespeichert. Änderungen werden als einzelne JSON-Zeilen an das
+# Journal angehängt, statt jedes Mal den gesamten Cache neu zu schreiben.
+# Erreicht das Journal die Größe der Momentaufnahme, wird es in eine neue
+# Momentaufnahme überführt.
+#
+# Einträge des Journals:
+#
+#  * `{ "op": "alert", "aid": ..., "data": ... }` → Warnung neu oder geändert
+#  * `{ "op": "state", "aid": ..., "attrs": ..., "txstate": ... }` → Attribute
+#    oder Übertragungsstatus geändert
+#  * `{ "op": "delete", "aid": ... }` → Warnung gelöscht
+#
+# Alle Einträge überschreiben den vorherigen Stand vollständig. Sie können
+# daher gefahrlos mehrfach angewendet werden, z.B. wenn das Programm zwischen
+# dem Schreiben der Momentaufnahme und dem Leeren des Journals abbricht.
+#
+class CacheStoreJson:
+    INDEXED = False
+
+    # Das Journal wird frühestens ab dieser Größe verdichtet.
+    JOURNAL_MIN = 256 * 1024
+
+
+    def __init__(self, config, logger):
+        self.logger = logger
 
         self.path = config.get_str('path')
-        self.age  = config.get_duration('purge', '31d')
+        self.path_journal = self.path + '.journal'
 
-        self.alerts = {}
+        self.snapshot_size = 0
+        self.journal_size = 0
+
+        # Verweise zwischen Warnungen in beide Richtungen: `refs` enthält für
+        # jede Warnung die IDs der Warnungen, auf die sie verweist,
+        # `referenced_by` für jede referenzierte ID die verweisenden
+        # Warnungen. Referenzierte Warnungen müssen nicht im Cache vorliegen.
+        self._refs = {}
+        self._referenced_by = {}
+
+
+    def load(self):
+        data = {}
 
         if os.path.isfile(self.path):
             with open(self.path) as f:
@@ -724,61 +1546,401 @@ class Cache:
                 except json.decoder.JSONDecodeError as e:
                     self.logger.error("Fehler beim Laden des Caches '%s'." % self.path)
                     self.logger.exception(e)
-                    return
+            self.snapshot_size = os.path.getsize(self.path)
         else:
             self.logger.debug("Cache '%s' existiert nicht." % self.path)
+
+        if os.path.isfile(self.path_journal):
+            offset = 0
+            with open(self.path_journal, 'rb') as f:
+                for lineno, line in enumerate(f, 1):
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError()
+                        record = json.loads(line)
+                    except ValueError:
+                        # Nur der letzte Eintrag kann bei einem Absturz
+                        # unvollständig geschrieben worden sein. Wir schneiden
+                        # ihn ab, damit neue Einträge nicht daran angehängt
+                        # werden.
+                        self.logger.warning("Unvollständiger Eintrag in Zeile %d von '%s' wird verworfen." % ( lineno, self.path_journal ))
+                        break
+
+                    self._replay(data, record)
+                    offset += len(line)
+
+            if offset != os.path.getsize(self.path_journal):
+                os.truncate(self.path_journal, offset)
+            self.journal_size = offset
+
+        return data
+
+
+    def _replay(self, data, record):
+        op = record.get('op', None)
+        aid = record.get('aid', None)
+
+        if op == 'alert':
+            data[aid] = record['data']
+        elif op == 'state':
+            if aid in data:
+                data[aid]['attrs'] = record['attrs']
+                data[aid]['txstate'] = record['txstate']
+        elif op == 'delete':
+            data.pop(aid, None)
+        else:
+            self.logger.warning("Unbekannter Journal-Eintrag '%s' in '%s'." % ( op, self.path_journal ))
+
+
+    def dump(self, alerts, deleted):
+        records = [ { 'op': 'delete', 'aid': aid } for aid in sorted(deleted) ]
+        for aid, alert in alerts.items():
+            if 'alert' in alert.dirty:
+                records.append({ 'op': 'alert', 'aid': aid, 'data': alert.cache_ctx })
+            elif 'state' in alert.dirty:
+                records.append({ 'op': 'state', 'aid': aid, 'attrs': alert.attrs, 'txstate': alert.txstate })
+
+        if len(records) == 0:
             return
 
-        for aid, alertdata in data.items():
+        lines = ''.join(json.dumps(record, cls = JSONDateTimeEncoder) + '\n' for record in records)
+
+        with open(self.path_journal, 'a') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_size += len(lines.encode())
+
+        if self.journal_size >= max(self.snapshot_size, self.JOURNAL_MIN):
+            self.compact(alerts)
+
+
+    def compact(self, alerts):
+        self.logger.info("Verdichte Journal '%s'." % self.path_journal)
+
+        data = { aid: alert.cache_ctx for aid, alert in alerts.items() }
+
+        # Momentaufnahme atomar ersetzen
+        path_tmp = self.path + '.tmp'
+        with open(path_tmp, 'w') as f:
+            json.dump(data, f, cls = JSONDateTimeEncoder)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path_tmp, self.path)
+        self.snapshot_size = os.path.getsize(self.path)
+
+        # Journal leeren
+        with open(self.path_journal, 'w') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_size = 0
+
+
+    def pid_counts(self, alerts):
+        counts = collections.Counter()
+
+        for alert in alerts.values():
+            counts.update(set(alert.attr_get('pids') or []))
+
+        return counts
+
+
+    def refs_add(self, alert):
+        refs = set(alert_references(alert))
+        self._refs[alert.aid] = refs
+        for ref_aid in refs:
+            self._referenced_by.setdefault(ref_aid, set()).add(alert.aid)
+
+
+    def refs_remove(self, aid):
+        for ref_aid in self._refs.pop(aid, set()):
+            referenced_by = self._referenced_by[ref_aid]
+            referenced_by.discard(aid)
+            if len(referenced_by) == 0:
+                del self._referenced_by[ref_aid]
+
+
+    def refs(self, aid):
+        return self._refs.get(aid, set())
+
+
+    def referenced_by(self, aid):
+        return self._referenced_by.get(aid, set())
+
+
+    def superseded(self):
+        return self._referenced_by.keys()
+
+
+    #
+    # Wir löschen veraltete Warnungen nur, wenn keine gültige Warnung mehr auf
+    # sie verweist.
+    #
+    def expired(self, alerts, thresh):
+        valid = { aid for aid, alert in alerts.items() if alert.capdata['sent'] >= thresh }
+        remove = [ aid for aid in alerts.keys() if aid not in valid and not self.referenced_by(aid) & valid ]
+
+        return valid, remove
+
+
+
+#
+# Alternativ kann der Cache in einer SQLite-Datenbank gespeichert werden. Neben
+# den Warnungen selbst werden die Verweise zwischen Warnungen (`refs`) und die
+# vergebenen Persistent-IDs (`pids`) in eigenen Tabellen abgelegt. Veraltete
+# und ersetzte Warnungen sowie Verweise lassen sich so über Indizes abfragen,
+# statt im Speicher einen Verweisgraphen über alle Warnungen zu pflegen.
+#
+# Geschrieben werden nur geänderte Warnungen, jeweils in einer Transaktion.
+# Indizierte Abfragen sehen nur den gespeicherten Stand. Der Cache sichert
+# ausstehende Änderungen deshalb vor jeder Abfrage (`INDEXED`).
+#
+# Beim Start werden alle Warnungen eingelesen, da der Cache sie im Speicher
+# vorhält. Filter und Alarmierung werten in jedem Durchlauf ohnehin alle
+# Warnungen aus, ein verzögertes Einlesen brächte daher keinen Vorteil.
+#
+class CacheStoreSqlite:
+    INDEXED = True
+
+    SCHEMA = \
+    [
+        'CREATE TABLE IF NOT EXISTS alerts (aid TEXT PRIMARY KEY, sent REAL NOT NULL, alert TEXT NOT NULL, attrs TEXT NOT NULL, txstate TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS alerts_sent ON alerts (sent)',
+        'CREATE TABLE IF NOT EXISTS refs (aid TEXT NOT NULL, ref_aid TEXT NOT NULL, PRIMARY KEY (aid, ref_aid)) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS refs_ref_aid ON refs (ref_aid)',
+        'CREATE TABLE IF NOT EXISTS pids (aid TEXT NOT NULL, pid INTEGER NOT NULL, PRIMARY KEY (aid, pid)) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS pids_pid ON pids (pid)',
+    ]
+
+
+    def __init__(self, config, logger):
+        self.logger = logger
+
+        self.path = config.get_str('path')
+
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+
+        # Fehlt in einer bestehenden Datenbank die Tabelle der Verweise, wird
+        # sie beim ersten Speichern aus den Warnungen neu aufgebaut.
+        tables = { name for name, in self.db.execute('SELECT name FROM sqlite_master WHERE type = \'table\'') }
+        self.rebuild = 'alerts' in tables and 'refs' not in tables
+
+        with self.db:
+            for statement in self.SCHEMA:
+                self.db.execute(statement)
+
+
+    def load(self):
+        data = {}
+
+        for aid, alert, attrs, txstate in self.db.execute('SELECT aid, alert, attrs, txstate FROM alerts'):
+            try:
+                data[aid] = \
+                {
+                    'alert':   json.loads(alert),
+                    'attrs':   json.loads(attrs),
+                    'txstate': json.loads(txstate),
+                }
+            except json.decoder.JSONDecodeError as e:
+                self.logger.error("Fehler beim Laden der Warnung '%s' aus dem Cache '%s'." % ( aid, self.path ))
+                self.logger.exception(e)
+
+        return data
+
+
+    def _write_state(self, alert):
+        self.db.execute('UPDATE alerts SET attrs = ?, txstate = ? WHERE aid = ?',
+                        ( json.dumps(alert.attrs, cls = JSONDateTimeEncoder), json.dumps(alert.txstate, cls = JSONDateTimeEncoder), alert.aid ))
+
+        self.db.execute('DELETE FROM pids WHERE aid = ?', ( alert.aid, ))
+        self.db.executemany('INSERT INTO pids (aid, pid) VALUES (?, ?)',
+                            [ ( alert.aid, pid ) for pid in set(alert.attr_get('pids') or []) ])
+
+
+    def dump(self, alerts, deleted):
+        with self.db:
+            for aid in deleted:
+                self.db.execute('DELETE FROM alerts WHERE aid = ?', ( aid, ))
+                self.db.execute('DELETE FROM refs WHERE aid = ?', ( aid, ))
+                self.db.execute('DELETE FROM pids WHERE aid = ?', ( aid, ))
+
+            for aid, alert in alerts.items():
+                if 'alert' in alert.dirty:
+                    self.db.execute('INSERT OR REPLACE INTO alerts (aid, sent, alert, attrs, txstate) VALUES (?, ?, ?, \'{}\', \'{}\')',
+                                    ( aid, alert.capdata['sent'].timestamp(), json.dumps(alert.capdata, cls = JSONDateTimeEncoder) ))
+
+                if 'alert' in alert.dirty or self.rebuild:
+                    self.db.execute('DELETE FROM refs WHERE aid = ?', ( aid, ))
+                    self.db.executemany('INSERT OR IGNORE INTO refs (aid, ref_aid) VALUES (?, ?)',
+                                        [ ( aid, ref_aid ) for ref_aid in alert_references(alert) ])
+
+                if alert.dirty:
+                    self._write_state(alert)
+
+        self.rebuild = False
+
+
+    def pid_counts(self, alerts):
+        return collections.Counter(dict(self.db.execute('SELECT pid, COUNT(*) FROM pids GROUP BY pid')))
+
+
+    # Verweise werden beim Speichern geschrieben
+    def refs_add(self, alert):
+        pass
+
+
+    def refs_remove(self, aid):
+        pass
+
+
+    def refs(self, aid):
+        return { ref_aid for ref_aid, in self.db.execute('SELECT ref_aid FROM refs WHERE aid = ?', ( aid, )) }
+
+
+    def referenced_by(self, aid):
+        return { ref_aid for ref_aid, in self.db.execute('SELECT aid FROM refs WHERE ref_aid = ?', ( aid, )) }
+
+
+    def superseded(self):
+        return { aid for aid, in self.db.execute('SELECT DISTINCT ref_aid FROM refs') }
+
+
+    def expired(self, alerts, thresh):
+        valid = { aid for aid, in self.db.execute('SELECT aid FROM alerts WHERE sent >= ?', ( thresh.timestamp(), )) }
+
+        # Wir löschen veraltete Warnungen nur, wenn keine gültige Warnung mehr
+        # auf sie verweist.
+        cursor = self.db.execute(
+            'SELECT aid FROM alerts WHERE sent < :thresh AND aid NOT IN '
+            '(SELECT refs.ref_aid FROM refs JOIN alerts ON alerts.aid = refs.aid WHERE alerts.sent >= :thresh)',
+            { 'thresh': thresh.timestamp() })
+
+        return valid, [ aid for aid, in cursor if aid in alerts ]
+
+
+
+CACHE_STORES = \
+{
+    'json':   CacheStoreJson,
+    'sqlite': CacheStoreSqlite,
+}
+
+
+
+#
+# Verwaltung der Persistent-IDs. Für jede ID wird gezählt, wie viele Warnungen
+# sie tragen. Wird eine ID von keiner Warnung mehr getragen, wandert sie in
+# einen Min-Heap freier IDs. Neue IDs werden nach First Fit vergeben, d.h. es
+# wird stets die kleinste freie ID gewählt. Die freien IDs ergeben sich
+# eindeutig aus den belegten IDs. Nach einem Neustart werden sie daher in der
+# selben Reihenfolge wiederverwendet.
+#
+class PersistentIdAllocator:
+    def __init__(self, counts):
+        self.counts = collections.Counter(counts)
+        self.next = max(self.counts.keys(), default = 0) + 1
+
+        # Bereits aufsteigend sortiert und damit ein gültiger Heap
+        self.free = [ pid for pid in range(1, self.next) if pid not in self.counts ]
+
+
+    def allocate(self):
+        if self.free:
+            pid = heapq.heappop(self.free)
+        else:
+            pid = self.next
+            self.next += 1
+
+        self.counts[pid] += 1
+        return pid
+
+
+    def acquire(self, pids):
+        for pid in pids:
+            self.counts[pid] += 1
+
+
+    def release(self, pids):
+        for pid in pids:
+            self.counts[pid] -= 1
+            if self.counts[pid] <= 0:
+                del self.counts[pid]
+                heapq.heappush(self.free, pid)
+
+
+
+class Cache:
+    def __init__(self, config):
+        self.logger = logging.getLogger('mowas.cache')
+
+        self.age  = config.get_duration('purge', '31d')
+        self.store = CACHE_STORES[config.get_enum('backend', CACHE_STORES.keys(), 'json')](config, self.logger)
+
+        self.alerts = {}
+        self.deleted = set()
+
+        # Neu aufgenommene Warnungen, die noch nicht sofort alarmiert wurden
+        self.fresh = []
+
+        # Die Verweise zwischen Warnungen verwaltet das Speicherformat: der
+        # JSON-Cache als Graph im Arbeitsspeicher, der SQLite-Cache in
+        # indizierten Tabellen.
+        for aid, alertdata in self.store.load().items():
             alert = Alert(alertdata['alert'])
             alert.cache_load(alertdata)
             self.alerts[aid] = alert
+            self.store.refs_add(alert)
+
+        self.pids = PersistentIdAllocator(self.store.pid_counts(self.alerts))
 
 
     def dump(self):
-        data = { aid: alert.cache_ctx for aid, alert in self.alerts.items() }
-        with open(self.path, 'w') as f:
-            json.dump(data, f, cls = JSONDateTimeEncoder, indent = 2)
+        self.store.dump(self.alerts, self.deleted)
+
+        self.deleted = set()
+        for alert in self.alerts.values():
+            alert.dirty.clear()
+
+
+    def _sync(self):
+        # Indizierte Abfragen des Speichers sehen nur gesicherte Änderungen.
+        if self.store.INDEXED:
+            self.dump()
 
 
     def update(self, alert):
         if alert.aid in self.alerts:
-            self.alerts[alert.aid].update(alert)
+            cached = self.alerts[alert.aid]
+            capdata = cached.capdata
+            cached.update(alert)
+            if cached.capdata is not capdata:
+                self.store.refs_remove(cached.aid)
+                self.store.refs_add(cached)
         else:
             thresh = datetime.datetime.now(datetime.timezone.utc) - self.age
             if alert.capdata['sent'] >= thresh:
+                alert.dirty.add('alert')
                 self.alerts[alert.aid] = alert
+                self.deleted.discard(alert.aid)
+                self.store.refs_add(alert)
+                self.fresh.append(alert)
 
 
     def purge(self):
         thresh = datetime.datetime.now(datetime.timezone.utc) - self.age
 
-        valid = set()
-        remove = set()
-
-        # Veraltete Warnungen bestimmen
-        for alert in self.alerts.values():
-            if alert.capdata['sent'] >= thresh:
-                valid.add(alert.aid)
-            else:
-                remove.add(alert.aid)
-
-        # Wir löschen veraltete Warnungen nur, wenn keine gültige Warnung mehr
-        # auf sie verweist.
-        for aid in valid:
-            alert = self.alerts[aid]
-
-            if 'references' not in alert.capdata:
-                continue
+        self._sync()
 
-            references = alert.capdata['references']
-            for ref in references.split():
-                ref_sender, ref_aid, ref_sent = ref.split(',')
-                remove.discard(ref_aid)
+        valid, remove = self.store.expired(self.alerts, thresh)
 
         for aid in remove:
             self.logger.info("Lösche Warnung '%s' aus Cache." % aid)
+            self.pids.release(set(self.alerts[aid].attr_get('pids') or []))
             del self.alerts[aid]
+            self.deleted.add(aid)
+            self.store.refs_remove(aid)
 
         return valid
 
@@ -797,102 +1959,92 @@ class Cache:
     # Aktualisierung erhält dann die beiden ursprünglichen Persistent-IDs.
     #
     def persistent_ids(self):
-        nopids = {}
-        pids   = {}
-        refs   = {}
-
-        for aid, alert in self.alerts.items():
-            pid = alert.attr_get('pids')
-            if pid is None:
-                # Warnungen ohne Persistent-ID sammeln
-                nopids[aid] = alert
-            else:
-                # Bestehende Persistent-IDs sammeln
-                pids[aid] = pid
+        # Warnungen ohne Persistent-ID sammeln
+        nopids = [ aid for aid, alert in self.alerts.items() if alert.attr_get('pids') is None ]
+        if len(nopids) == 0:
+            return
 
-            refs[aid] = set()
-            if 'references' in alert.capdata:
-                for ref in alert.capdata['references'].split():
-                    ref_sender, ref_aid, ref_sent = ref.split(',')
+        self._sync()
+        refs = { aid: self.store.refs(aid) for aid in nopids }
 
-                    # Warnungen überspringen, die nicht mehr vorliegen
-                    if ref_aid not in self.alerts:
-                        continue
+        # Eine Warnung ohne Persistent-ID kann erst getaggt werden, wenn alle
+        # Warnungen, auf die sie verweist, eine Persistent-ID haben. Wir zählen
+        # daher für jede Warnung die noch ausstehenden Verweise und arbeiten
+        # die Warnungen in topologischer Reihenfolge ab.
+        pending = {}
+        for aid in nopids:
+            pending[aid] = 0
+        for aid in nopids:
+            pending[aid] = len(refs[aid] & pending.keys())
 
-                    refs[aid].add(ref_aid)
+        ready = collections.deque(aid for aid in nopids if pending[aid] == 0)
 
-        # Belegte Persistent-IDs bestimmen
-        usedpids = set()
-        for pid in pids.values():
-            usedpids |= set(pid)
+        while pending:
+            if ready:
+                aid = ready.popleft()
+            else:
+                # Alle verbliebenen Warnungen sind Bestandteil eines
+                # zirkulären Verweises oder verweisen auf einen solchen. Wir
+                # brechen den Kreis deterministisch bei der kleinsten ID auf
+                # und ignorieren deren noch ausstehende Verweise.
+                aid = min(pending.keys())
+                self.logger.error("Warnung '%s' ist Bestandteil eines zirkulären Verweises." % aid)
+
+            del pending[aid]
+
+            # Die Warnung `aid` erhält alle Persistent-IDs der Warnungen, auf
+            # die sie referenziert.
+            pid = set()
+            for ref_aid in refs[aid]:
+                if ref_aid in self.alerts:
+                    pid |= set(self.alerts[ref_aid].attr_get('pids') or [])
+
+            # Sollte es keine referenzierten Warnungen geben, vergeben wir eine
+            # neue Persistent-ID. Es wird bei 1 beginnend eine nicht belegte ID
+            # nach First Fit gesucht.
+            pid = sorted(pid)
+            if len(pid) == 0:
+                pid = [ self.pids.allocate() ]
+            else:
+                self.pids.acquire(pid)
 
-        # Freie Persistent-IDs bestimmen
-        if len(usedpids) == 0:
-            freepids = list(range(1, len(nopids) + 1))
-        else:
-            freepids = sorted(set(range(1, max(usedpids) + 1)) - usedpids)[:len(nopids)]
-            if len(freepids) < len(nopids):
-                freepids.extend(range(max(usedpids) + 1, max(usedpids) + len(nopids) - len(freepids) + 1))
-
-        # Warnungen ohne Persistent-ID taggen
-        rerun = True
-        while rerun:
-            rerun = False
-            nopids_new = {}
-            for aid, alert in nopids.items():
-                # Wir berechnen die Menge aller Referenzen von `aid`, die noch
-                # keine Persistent-ID haben. Dann können wir auch für `aid`
-                # noch keine Persistent-ID vergeben und merken und diese
-                # Warnung für den nächsten Durchlauf.
-                if refs[aid] - set(pids.keys()):
-                    nopids_new[aid] = alert
-                    continue
+            # Persistent-IDs zuweisen
+            self.alerts[aid].attr_set('pids', pid)
 
-                # Die Warnung `aid` erhält alle Persistent-IDs der Warnungen,
-                # auf die sie referenziert.
-                pid = set()
-                for ref_aid in refs[aid]:
-                    pid |= set(pids[ref_aid])
+            # Warnungen, die auf `aid` verweisen, können nun ggf. ebenfalls
+            # getaggt werden.
+            for ref_aid in self.store.referenced_by(aid):
+                if ref_aid in pending:
+                    pending[ref_aid] -= 1
+                    if pending[ref_aid] == 0:
+                        ready.append(ref_aid)
 
-                # Sollte es keine referenzierten Warnungen geben, vergeben wir
-                # eine neue Persistent-ID. Es wird bei 1 beginnend eine nicht
-                # belegte ID nach First Fit gesucht.
-                pid = sorted(pid)
-                if len(pid) == 0:
-                    pid = [ freepids.pop(0) ]
 
-                # Persistent-IDs zuweisen
-                pids[aid] = pid
-                alert.attr_set('pids', pid)
+    #
+    # Neu aufgenommene Warnungen entnehmen, damit sie sofort alarmiert werden
+    # können. Zwischenzeitlich gelöschte oder bereits ersetzte Warnungen
+    # werden ausgelassen.
+    #
+    def query_fresh(self):
+        if len(self.fresh) == 0:
+            return []
 
-                # Da wir neue Persistent-IDs vergeben haben, können weitrere
-                # Nachrichten, die ggf. auf `aid` verweisen, mit einer
-                # Persistent-ID versehen werden. Es muss also ein weiterer
-                # Durchlauf erfolgen.
-                rerun = True
+        self._sync()
+        superseded = self.store.superseded()
 
-            # Noch nicht mit einer Persistent-ID versehene Warnungen für den
-            # nächsten Durchlauf vormerken.
-            nopids = nopids_new
+        fresh = [ alert for alert in self.fresh if self.alerts.get(alert.aid, None) is alert and alert.aid not in superseded ]
+        self.fresh = []
 
-        for aid in nopids.keys():
-            self.logger.error("Warnung '%s' ist Bestandteil eines zirkulären Verweises." % aid)
-            # TODO: einzelne IDs vergeben?
+        return fresh
 
 
     def query(self):
-        aid_references = set()
+        self._sync()
 
-        # Warnungen bestimmen, die durch Aktualisierungen ersetzt wurden
-        for aid in sorted(self.alerts.keys()):
-            alert = self.alerts[aid]
-            if 'references' not in alert.capdata:
-                continue
-            for ref in alert.capdata['references'].split():
-                ref_sender, ref_aid, ref_sent = ref.split(',')
-                aid_references.add(ref_aid)
+        # Warnungen, die durch Aktualisierungen ersetzt wurden, auslassen
+        superseded = self.store.superseded()
 
-        return [ alert for aid, alert in self.alerts.items() if aid not in aid_references ]
+        return [ alert for aid, alert in self.alerts.items() if aid not in superseded ]
 
 
 
@@ -941,6 +2093,17 @@ class Filter:
     ]
 
 
+    # Stellen, an denen ein Gebietsschlüssel eine übergeordnete Ebene
+    # abgrenzt. Die übrigen Stellen sind dort mit Nullen aufgefüllt.
+    GEOCODE_LEVELS = [ 0, 2, 3, 5, 9 ]
+
+    # Ergebnisse der Gebietsprüfung teilen sich alle Filter mit den selben
+    # Gebietsschlüsseln. Sie hängen nur vom Gebietsschlüssel ab und bleiben
+    # daher über Durchläufe hinweg gültig.
+    GEOCODE_MEMOS = {}
+    GEOCODE_MEMO_SIZE = 65536
+
+
     # Übergeordnete Bereiche bestimmen
     def _area_superset(self, geocode : str) -> set:
         areas = []
@@ -999,10 +2162,42 @@ class Filter:
         for r in self.geocodes:
             self.geocodes_super |= self._area_superset(r)
 
+        # Gebietsschlüssel, die eine ganze Ebene abdecken, als Präfix ohne
+        # die auffüllenden Nullen ablegen. Ein untergeordneter Schlüssel
+        # beginnt dann mit einem dieser Präfixe.
+        self.geocodes_prefix = { r[0:k] for r in self.geocodes for k in self.GEOCODE_LEVELS if r[k:] == "0" * (12 - k) }
+
+        self.geocode_memo = self.GEOCODE_MEMOS.setdefault(frozenset(self.geocodes), {})
+
+        # Zeitunabhängige Filterergebnisse je Warnung mit der Revision, für
+        # die sie berechnet wurden. Gelöschte Warnungen fallen von selbst
+        # heraus.
+        self.static = weakref.WeakKeyDictionary()
+
         # Maximales Alter einer Warnung bei Erstalarmierung
         self.max_age = config.get_duration('max_age', '4h')
 
 
+    #
+    # Eine Nachricht wird übernommen, wenn sie unterhalb der von uns
+    # spezifizierten Gebiete liegt oder für eines der uns übergeordneten
+    # Gebiete kodiert ist.
+    #
+    def geocode_match(self, gcode):
+        match = self.geocode_memo.get(gcode, None)
+        if match is not None:
+            return match
+
+        match = gcode in self.geocodes_super or \
+                any(gcode[0:k] in self.geocodes_prefix for k in self.GEOCODE_LEVELS if k <= len(gcode))
+
+        if len(self.geocode_memo) >= self.GEOCODE_MEMO_SIZE:
+            self.geocode_memo.clear()
+        self.geocode_memo[gcode] = match
+
+        return match
+
+
     #
     # Diese Funktion filtert alle relevanten Teile aus einer Warnung `alert`
     # heraus. `t` ist die aktuelle Zeit. `tfirst` und `tlast` sind der
@@ -1057,12 +2252,32 @@ class Filter:
         if 'info' not in alert.capdata:
             return None
 
+        # Nur die zeitabhängigen Bedingungen werden bei jedem Aufruf geprüft.
+        # Alle übrigen werden erst nach einer Änderung der Warnung neu
+        # ausgewertet.
+        revision, static = self.static.get(alert, ( None, None ))
+        if revision != alert.revision:
+            static = self._match_static(alert)
+            self.static[alert] = ( alert.revision, static )
+
         infos = {}
-        for infoidx, info in enumerate(alert.capdata['info']):
+        for infoidx, infodata in static.items():
             # Abgelaufene Meldungen verwerfen
+            info = alert.capdata['info'][infoidx]
             if 'expires' in info and info['expires'] < t:
                 continue
 
+            infos[infoidx] = infodata
+
+        if len(infos) == 0:
+            return None
+
+        return { 'info': infos }
+
+
+    def _match_static(self, alert):
+        infos = {}
+        for infoidx, info in enumerate(alert.capdata['info']):
             # Metadaten filtern
             if 'category' in info and self.category is not None and \
                len({ v.lower() for v in info['category'] } & self.category) == 0:
@@ -1093,16 +2308,7 @@ class Filter:
                 if 'geocode' not in area:
                     continue
 
-                # Eine Nachricht wird übernommen, wenn sie unterhalb der von
-                # uns spezifizierten Gebiete liegt oder für eines der uns
-                # übergeordneten Gebiete kodiert ist.
-                geocodes = set()
-                for gidx, g in enumerate(area['geocode']):
-                    gcode = g['value']
-                    geocode_super = self._area_superset(gcode)
-                    if gcode in self.geocodes_super or \
-                       len(geocode_super & self.geocodes) > 0:
-                        geocodes.add(gidx)
+                geocodes = { gidx for gidx, g in enumerate(area['geocode']) if self.geocode_match(g['value']) }
 
                 if len(geocodes) == 0:
                     continue
@@ -1118,14 +2324,15 @@ class Filter:
                 infos[infoidx] = {}
             infos[infoidx]['area'] = areas
 
-        if len(infos) == 0:
-            return None
-
-        return { 'info': infos }
+        return infos
 
 
 
 class Schedule:
+    # Wir sehen einen Jitter-Puffer von 5 Sekunden vor.
+    JITTER = datetime.timedelta(seconds = 5)
+
+
     def __init__(self, config):
         sched = []
         for thresh, interval in config.tree.items():
@@ -1142,34 +2349,68 @@ class Schedule:
             sched.append(( thresh, interval ))
         sched.sort()
 
-        # Wir bestimmen alle Wiederholungszeitpunkt ab t = 0.
-        self.sched = [ datetime.timedelta(seconds = 0) ]
+        # Die Wiederholungszeitpunkte ab t = 0 legen wir abschnittsweise als
+        # ( Beginn, Intervall, Anzahl ) ab. Ein Abschnitt umfasst die
+        # Zeitpunkte `Beginn + k * Intervall` für k = 1 … Anzahl. In `ends`
+        # steht jeweils der letzte Zeitpunkt eines Abschnitts.
+        self.segments = []
+        self.ends = []
+
+        end = datetime.timedelta(seconds = 0)
         for thresh, interval in sched:
-            n = (thresh - self.sched[-1]) // interval
-            for i in range(n):
-                self.sched.append(self.sched[-1] + interval)
+            n = (thresh - end) // interval
+            if n <= 0:
+                continue
 
+            self.segments.append(( end, interval, n ))
+            end += n * interval
+            self.ends.append(end)
 
-    def tx_required(self, alert, ttype, tname, t):
-        first, last = alert.tx_status(ttype, tname)
-        if first is None or last is None:
-            return True
 
+    #
+    # Nächster Übertragungszeitpunkt einer Warnung, die erstmalig zum Zeitpunkt
+    # `first` und zuletzt zum Zeitpunkt `last` übertragen wurde. Sind alle
+    # Übertragungen abgeschlossen, wird `None` zurückgegeben.
+    #
+    def tx_next(self, first, last):
         diff = last - first
+        if diff < datetime.timedelta(seconds = 0):
+            return first
 
-        # Alle vorausliegenden Übertragungszeitpunkte berechnen
-        diffs = [ d for d in self.sched if d > diff ]
+        # Ersten Abschnitt bestimmen, der noch vorausliegende
+        # Übertragungszeitpunkte enthält.
+        i = bisect.bisect_right(self.ends, diff)
 
         # Alle Übertragungen wurden abgeschlossen
-        if len(diffs) == 0:
+        if i == len(self.segments):
+            return None
+
+        # Ersten Übertragungszeitpunkt des Abschnitts nach `diff` berechnen
+        start, interval, n = self.segments[i]
+        k = max((diff - start) // interval + 1, 1)
+
+        return first + start + k * interval
+
+
+    def tx_required(self, alert, ttype, tname, t):
+        first, last = alert.tx_status(ttype, tname)
+        if first is None or last is None:
+            return True
+
+        due = self.tx_next(first, last)
+        if due is None:
             return False
 
-        # Wir sehen einen Jitter-Puffer von 5 Sekunden vor.
-        return first + diffs[0] <= t + datetime.timedelta(seconds = 5)
+        return due <= t + self.JITTER
 
 
 
 class Target:
+    # Wartezeit, bevor Wiederholungen nach einer fehlgeschlagenen Alarmierung
+    # erneut versucht werden
+    TX_RETRY = datetime.timedelta(seconds = 10)
+
+
     def __init__(self, tname, config):
         self.tname = tname
         self.logger = logging.getLogger('mowas.target.%s.%s' % ( self.ttype, self.tname ))
@@ -1177,45 +2418,116 @@ class Target:
         self.sched = Schedule(config.get_subtree('schedule', "Ungültiger Widerholungsrhythmus für Senke '%s/%s'" % ( self.ttype, self.tname )))
         self.filter = Filter(config.get_subtree('filter', "Ungültige Filter-Konfiguration für Senke '%s/%s'" % ( self.ttype, self.tname ), True), self.logger)
 
+        # Anstehende Wiederholungen als Heap aus ( Zeitpunkt, Alert-ID ).
+        # Einträge werden nicht entfernt, wenn sich eine Warnung ändert oder
+        # gelöscht wird. Ein veralteter Eintrag führt lediglich zu einem
+        # Durchlauf, in dem nichts zu tun ist.
+        self.due = []
+
+
+    #
+    # Nächste Wiederholung der Warnung `alert` vormerken
+    #
+    def tx_schedule(self, alert):
+        first, last = alert.tx_status(self.ttype, self.tname)
+        if first is None or last is None:
+            return
+
+        due = self.sched.tx_next(first, last)
+        if due is not None:
+            heapq.heappush(self.due, ( due, alert.aid ))
+
+
+    #
+    # Gibt zurück, ob die Senke zum Zeitpunkt `t` etwas zu tun hat
+    #
+    def tx_pending(self, t):
+        return len(self.due) > 0 and self.due[0][0] <= t + self.sched.JITTER
+
+
+    #
+    # Vorgemerkte Wiederholungen entnehmen, die zum Zeitpunkt `t` fällig sind.
+    # Nach einer erfolgreichen Alarmierung sind die gesendeten Warnungen
+    # bereits neu vorgemerkt.
+    #
+    def tx_take(self, t):
+        due = []
+        while self.due and self.due[0][0] <= t + self.sched.JITTER:
+            due.append(heapq.heappop(self.due))
+
+        return due
+
+
+    #
+    # Entnommene Wiederholungen nach einer fehlgeschlagenen Alarmierung nach
+    # kurzer Wartezeit erneut vormerken. Sofort fällige Einträge würden die
+    # Hauptschleife ohne Pause erneut wecken.
+    #
+    def tx_retry(self, due, t):
+        for _, aid in due:
+            heapq.heappush(self.due, ( t + self.TX_RETRY, aid ))
+
+
+    #
+    # Zeitpunkt der nächsten vorgemerkten Wiederholung
+    #
+    def tx_next(self):
+        if len(self.due) == 0:
+            return None
+
+        return self.due[0][0]
+
+
+    #
+    # Beim Beenden des Programms aufgerufen, um Verbindungen zu schließen
+    #
+    def close(self):
+        pass
+
 
     def query(self, alerts, t):
         for alert in alerts:
+            # Nachrichten nur wiederholen, wenn es das Wiederholungsintervall
+            # verlangt. Das trifft in den meisten Durchläufen nur auf wenige
+            # Warnungen zu, daher prüfen wir es zuerst.
+            if not self.sched.tx_required(alert, self.ttype, self.tname, t):
+                continue
+
             tfirst, tlast = alert.tx_status(self.ttype, self.tname)
 
             filterids = self.filter.match(alert, t, tfirst, tlast)
             if filterids is None:
                 continue
 
-            # Neuen CAP-Datensatz erstellen, der nur die für den Filter
-            # relevanten Informationen enthält.
-            capdata = copy.deepcopy(alert.capdata)
-
-            infosnew = []
-            for infoidx, infodata in filterids.get('info', {}).items():
-                info = capdata['info'][infoidx]
-                areasnew = []
-                for areaidx, areadata in infodata.get('area', {}).items():
-                    area = info['area'][areaidx]
-                    geocodesnew = []
-                    for geocodeidx in areadata.get('geocode', set()):
-                        geocode = area['geocode'][geocodeidx]
-                        geocodesnew.append(geocode)
-                    area['geocode'] = geocodesnew
-                    areasnew.append(area)
-                info['area'] = areasnew
-                infosnew.append(info)
-            capdata['info'] = infosnew
+            yield alert, self._filter_view(alert.capdata, filterids)
 
-            # Nachrichten nur wiederholen, wenn es das Wiederholungsintervall
-            # verlangt.
-            if not self.sched.tx_required(alert, self.ttype, self.tname, t):
-                continue
 
-            yield alert, capdata
+    #
+    # Neuen CAP-Datensatz erstellen, der nur die für den Filter relevanten
+    # Informationen enthält. Es werden nur die Ebenen kopiert, deren Listen
+    # gekürzt werden. Alle übrigen Elemente werden mit dem ursprünglichen
+    # Datensatz geteilt und dürfen daher nicht verändert werden.
+    #
+    def _filter_view(self, capdata, filterids):
+        infosnew = []
+        for infoidx, infodata in filterids.get('info', {}).items():
+            info = capdata['info'][infoidx]
+            areasnew = []
+            for areaidx, areadata in infodata.get('area', {}).items():
+                area = info['area'][areaidx]
+                geocodesnew = [ area['geocode'][geocodeidx] for geocodeidx in areadata.get('geocode', set()) ]
+                areasnew.append({ **area, 'geocode': geocodesnew })
+            infosnew.append({ **info, 'area': areasnew })
+
+        return { **capdata, 'info': infosnew }
 
 
 
 class TargetAprs(Target):
+    # Höchstanzahl zwischengespeicherter Positionsberechnungen
+    POS_CACHE_SIZE = 1024
+
+
     def __init__(self, tname, config):
         super().__init__(tname, config)
 
@@ -1245,6 +2557,42 @@ class TargetAprs(Target):
 
         self.digipath = [ parse_ax25addr(addr) for addr in self.digipath ]
 
+        self._pos_cache = collections.OrderedDict()
+
+
+    #
+    # Die Positionsberechnung ist aufwändig, ändert sich zwischen zwei
+    # Durchläufen aber i.d.R. nicht. Wir merken uns die Ergebnisse daher
+    # anhand der Warnung, der Textmeldung und der Gebietsangaben. Ändern sich
+    # die Gebietsangaben durch eine Aktualisierung, ändert sich auch der
+    # Schlüssel.
+    #
+    def _get_pos_cached(self, alert, infoidx, info):
+        if not self.beacon:
+            return []
+
+        fingerprint = []
+        for area in info['area']:
+            if 'polygon' in area:
+                fingerprint.append(( 'polygon', tuple(area['polygon']) ))
+            elif 'geocode' in area:
+                fingerprint.append(( 'geocode', tuple(g['value'] for g in area['geocode']) ))
+
+        key = ( alert.aid, infoidx, tuple(fingerprint), self.max_areas )
+
+        pos = self._pos_cache.get(key, None)
+        if pos is not None:
+            self._pos_cache.move_to_end(key)
+            return pos
+
+        pos = self._get_pos(alert, info)
+
+        self._pos_cache[key] = pos
+        while len(self._pos_cache) > self.POS_CACHE_SIZE:
+            self._pos_cache.popitem(last = False)
+
+        return pos
+
 
     #
     # APRS kann im Endeffekt nur Punktkoordinaten behandeln. Es besteht eine
@@ -1275,7 +2623,11 @@ class TargetAprs(Target):
         if not self.beacon:
             return []
 
-        polys = []
+        # Jedes Gebiet wird entweder durch ein Polygon aus dem Warndatensatz
+        # oder durch einen Regionalschlüssel samt Eintrag im Gebietsindex
+        # beschrieben. Wir zählen dabei die Einzelflächen mit.
+        areas = []
+        nparts = 0
 
         # Wir behandeln jedes Gebiet einzeln.
         for area in info['area']:
@@ -1309,32 +2661,44 @@ class TargetAprs(Target):
 
                     ring.FlattenTo2D()
                     polygon.AddGeometry(ring)
-                polys.append(polygon)
+                areas.append(( polygon, None, None ))
+                nparts += 1
 
             # Enthält der Warndatensatz keine Gebietsangabe, verwenden wir den
             # kodierten Regionalschlüssel und schlagen in der amtlichen
             # Datenbank nach.
             elif 'geocode' in area:
                 for geocode in area['geocode']:
-                    arsmultipolygon = GEODATA.ars_get(geocode['value'])
-                    if arsmultipolygon is None:
+                    index = GEODATA.ars_index(geocode['value'])
+                    if index is None:
                         self.logger.warning("Warnung '%s': Gebietsschlüssel '%s' (%s) nicht in Polygon auflösbar." % ( alert.aid, geocode['value'], geocode['valueName'] ))
                     else:
-                        for i in range(arsmultipolygon.GetGeometryCount()):
-                            polys.append(arsmultipolygon.GetGeometryRef(i))
+                        areas.append(( None, geocode['value'], index ))
+                        nparts += index.parts
 
-        # Zu viele Einzelflächen bei Bedarf zusammenführen
-        if self.max_areas > 0 and len(polys) > self.max_areas:
-            multipolygon = ogr.Geometry(ogr.wkbMultiPolygon)
-            for poly in polys:
-                multipolygon.AddGeometry(poly)
-            polys = [ multipolygon ]
+        points = []
+        if self.max_areas > 0 and nparts > self.max_areas:
+            # Zu viele Einzelflächen bei Bedarf zusammenführen
+            points.append(self._get_centroid_union(areas))
+        else:
+            for polygon, ars, index in areas:
+                if polygon is not None:
+                    points.append(polygon.Centroid())
+                elif index.parts == 1:
+                    # Bei Gebieten aus nur einer Fläche genügt der Index.
+                    points.append(self._get_point(index.x, index.y))
+                else:
+                    # Andernfalls benötigen wir die Schwerpunkte aller
+                    # Teilflächen und laden das Polygon nach.
+                    arsmultipolygon = GEODATA.ars_get(ars)
+                    if arsmultipolygon is None:
+                        continue
+                    for i in range(arsmultipolygon.GetGeometryCount()):
+                        points.append(arsmultipolygon.GetGeometryRef(i).Centroid())
 
-        # Polygone in Koordinaten auflösen
+        # Koordinaten übernehmen
         pos = []
-        for poly in polys:
-            p = poly.Centroid()
-
+        for p in points:
             # ungültige Geometrien verwerfen
             if not p.IsValid() or p.IsEmpty():
                 continue
@@ -1344,6 +2708,52 @@ class TargetAprs(Target):
         return pos
 
 
+    def _get_point(self, x, y):
+        p = ogr.Geometry(ogr.wkbPoint)
+        p.AddPoint_2D(x, y)
+        return p
+
+
+    #
+    # Der Schwerpunkt der Vereinigung mehrerer Flächen ist das mit dem
+    # Flächeninhalt gewichtete Mittel der einzelnen Schwerpunkte. Für Gebiete
+    # aus der amtlichen Datenbank genügen dafür die Angaben aus dem Index. Nur
+    # wenn die Gesamtfläche entartet ist, setzen wir die Polygone tatsächlich
+    # zu einem Multipolygon zusammen.
+    #
+    def _get_centroid_union(self, areas):
+        sx = 0.0
+        sy = 0.0
+        sa = 0.0
+        for polygon, ars, index in areas:
+            if polygon is not None:
+                centroid = polygon.Centroid()
+                x, y, a = centroid.GetX(), centroid.GetY(), polygon.GetArea()
+            else:
+                x, y, a = index.x, index.y, index.area
+
+            sx += a * x
+            sy += a * y
+            sa += a
+
+        if sa > 0.0:
+            return self._get_point(sx / sa, sy / sa)
+
+        multipolygon = ogr.Geometry(ogr.wkbMultiPolygon)
+        for polygon, ars, index in areas:
+            if polygon is not None:
+                multipolygon.AddGeometry(polygon)
+                continue
+
+            arsmultipolygon = GEODATA.ars_get(ars)
+            if arsmultipolygon is None:
+                continue
+            for i in range(arsmultipolygon.GetGeometryCount()):
+                multipolygon.AddGeometry(arsmultipolygon.GetGeometryRef(i))
+
+        return multipolygon.Centroid()
+
+
     #
     # APRS-Baken können mit einem fixen Zeitpunkt verknüpft werden.
     #
@@ -1565,12 +2975,17 @@ class TargetAprs(Target):
     def alert(self, alerts):
         t = datetime.datetime.now(datetime.timezone.utc)
 
-        frames = []
+        # Frames neuer Warnungen werden vor Wiederholungen gesendet.
+        frames_new = []
+        frames_repeat = []
         alerts_send = []
         for alert, capdata in self.query(alerts, t):
             pids = alert.attr_get('pids')
             multiinfo = len(capdata['info']) > 1
 
+            tfirst, tlast = alert.tx_status(self.ttype, self.tname)
+            frames = frames_new if tfirst is None else frames_repeat
+
             # Feststellen, ob es eine Entwarnung ist.
             if 'msgType' in capdata:
                 cancel = capdata['msgType'].lower() == 'cancel'
@@ -1581,7 +2996,7 @@ class TargetAprs(Target):
             # APRS-Objekte.
             for infoidx, info in enumerate(capdata['info']):
                 symbol = APRSSymbol(self.symbol[0], self.symbol[1])
-                pos = self._get_pos(alert, info)
+                pos = self._get_pos_cached(alert, infoidx, info)
                 time = self._get_time(info, capdata, t)
                 comment = self._get_comment(info)
 
@@ -1591,14 +3006,269 @@ class TargetAprs(Target):
             alerts_send.append(alert)
 
         # Alle Frames auf einmal senden
-        self.send(frames)
+        self.send(frames_new, frames_repeat)
 
         for alert in alerts_send:
             alert.tx_done(self.ttype, self.tname, t)
+            self.tx_schedule(alert)
+
+
+    def send(self, frames_new, frames_repeat):
+        raise NotImplementedError("Für den Treiber '%s' ist keine Alarmierungsroutine implementiert." % self.ttype)
+
+
+
+#
+# Langlebige TCP-Verbindung zu einer Gegenstelle. Die Verbindung wird bei
+# Bedarf aufgebaut und bleibt zwischen zwei Sendezyklen bestehen. Schlägt der
+# Aufbau oder eine Übertragung fehl, wird die Verbindung geschlossen und erst
+# nach einer Wartezeit erneut aufgebaut. Die Wartezeit verdoppelt sich mit
+# jedem Fehlschlag ausgehend von `backoff` bis höchstens `backoff_max`
+# Sekunden. Jeder Schreibvorgang ist durch `timeout` begrenzt, sodass eine
+# hängende Gegenstelle die Hauptschleife nicht blockiert.
+#
+class TcpLink:
+    def __init__(self, logger, host, port, config):
+        self.logger = logger
+
+        self.host = host
+        self.port = port
+
+        self.timeout     = config.get_float('timeout', 10)
+        self.backoff_min = config.get_float('backoff', 1)
+        self.backoff_max = config.get_float('backoff_max', 300)
+
+        if self.timeout <= 0:
+            raise ConfigException("Ungültiges Attribut 'timeout': Wert muss positiv sein.")
+        if self.backoff_min <= 0:
+            raise ConfigException("Ungültiges Attribut 'backoff': Wert muss positiv sein.")
+        if self.backoff_max < self.backoff_min:
+            raise ConfigException("Ungültiges Attribut 'backoff_max': Wert darf nicht kleiner als 'backoff' sein.")
+
+        self.sock = None
+        self.backoff = 0
+        self.retry_at = 0
+        self.last_write = 0
+
+
+    def _open(self):
+        if self.sock is not None:
+            return True
+
+        # Nach einem Fehlschlag warten wir zunächst ab
+        if time.monotonic() < self.retry_at:
+            return False
+
+        try:
+            self.sock = socket.create_connection(( self.host, self.port ), timeout = self.timeout)
+            self._connected()
+        except OSError as e:
+            self.logger.error("Kann keine Verbindung zu '%s:%s' aufbauen: %s" % ( self.host, self.port, e ))
+            self._fail()
+            return False
+
+        self.logger.info("Verbindung zu '%s:%s' aufgebaut." % ( self.host, self.port ))
+        self.backoff = 0
+        self.last_write = time.monotonic()
+        return True
+
+
+    def _fail(self):
+        self.close()
+
+        self.backoff = min(max(self.backoff * 2, self.backoff_min), self.backoff_max)
+        self.retry_at = time.monotonic() + self.backoff
+
+
+    # Wird nach dem Verbindungsaufbau aufgerufen, z.B. für eine Anmeldung
+    def _connected(self):
+        pass
+
+
+    # Wird für empfangene Daten aufgerufen. Standardmäßig werden sie verworfen.
+    def _received(self, data):
+        pass
+
+
+    #
+    # Bereits empfangene Daten abholen, ohne zu blockieren. Dabei fällt auch
+    # auf, wenn die Gegenstelle die Verbindung geschlossen hat.
+    #
+    def _receive(self):
+        self.sock.setblocking(False)
+        try:
+            while True:
+                data = self.sock.recv(4096)
+                if len(data) == 0:
+                    raise ConnectionResetError("Verbindung durch Gegenstelle geschlossen")
+                self._received(data)
+        except BlockingIOError:
+            pass
+        finally:
+            self.sock.settimeout(self.timeout)
+
+
+    #
+    # Überträgt die Datenblöcke aus `chunks` der Reihe nach. Erfolgreich
+    # übertragene Blöcke werden entnommen, die übrigen verbleiben für einen
+    # späteren Versuch. Ein abgebrochener Block wird vollständig wiederholt.
+    #
+    def write(self, chunks):
+        if not self._open():
+            return False
+
+        try:
+            self._receive()
+            while chunks:
+                self.sock.sendall(chunks[0])
+                chunks.popleft()
+                self.last_write = time.monotonic()
+        except OSError as e:
+            self.logger.error("Fehler bei der Übertragung an '%s:%s': %s" % ( self.host, self.port, e ))
+            self._fail()
+            return False
+
+        return True
+
+
+    def close(self):
+        if self.sock is None:
+            return
+
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.sock = None
+
+
+
+#
+# Sitzung mit einem APRS-IS-Server. Nach dem Verbindungsaufbau melden wir uns
+# einmalig an und warten auf die Bestätigung (`# logresp ...`). Der Server
+# sendet regelmäßig Kommentarzeilen als Lebenszeichen. Diese werden bei jedem
+# Schreibvorgang abgeholt und verworfen.
+#
+class AprsIsLink(TcpLink):
+    def __init__(self, logger, host, port, config, login):
+        super().__init__(logger, host, port, config)
+
+        self.login = login
+
+
+    def _connected(self):
+        self.sock.sendall(self.login)
+
+        response = b''
+        while b'# logresp' not in response:
+            data = self.sock.recv(4096)
+            if len(data) == 0:
+                raise ConnectionResetError("Verbindung durch Gegenstelle geschlossen")
+            response += data
+
+        for line in response.splitlines():
+            if line.startswith(b'# logresp'):
+                self.logger.info("Anmeldung am APRS-Server '%s:%s': %s" % ( self.host, self.port, line.decode(errors = 'replace') ))
+
+
+    def _received(self, data):
+        for line in data.splitlines():
+            if line.startswith(b'#'):
+                self.logger.debug("APRS-Server '%s:%s': %s" % ( self.host, self.port, line.decode(errors = 'replace') ))
+
+
+
+#
+# KISS-Kodierung von AX.25-Frames. Ein Frame wird nur einmal maskiert und dann
+# für alle KISS-Ports wiederverwendet. Das Ergebnis eines Frames für alle Ports
+# bildet einen Block, der unabhängig von anderen Frames übertragen werden kann.
+#
+class KissEncoder:
+    FEND = b'\xc0'
+
+    # FEND und FESC werden in einem Durchlauf maskiert
+    ESCAPE = re.compile(b'[\xc0\xdb]')
+    ESCAPES = \
+    {
+        b'\xc0': b'\xdb\xdc',
+        b'\xdb': b'\xdb\xdd',
+    }
+
+
+    def __init__(self, ports):
+        self.commands = [ bytes([ 16 * (p % 16) ]) for p in ports ]
+
+
+    def encode(self, frame):
+        data = self.ESCAPE.sub(lambda m: self.ESCAPES[m.group(0)], bytes(frame))
+
+        kissdata = bytearray()
+        for command in self.commands:
+            kissdata += self.FEND
+            kissdata += command
+            kissdata += data
+            kissdata += self.FEND
+
+        return bytes(kissdata)
+
+
+
+#
+# Begrenzung der Sendezeit auf einem Funkkanal nach dem Token-Bucket-Verfahren.
+# Für jeden Frame wird die Sendezeit aus seiner Länge und der Baudrate
+# geschätzt. Das Guthaben wächst mit `duty_cycle` Sekunden Sendezeit je
+# Sekunde bis höchstens `burst` Sekunden an. Ein Frame darf gesendet werden,
+# sobald das Guthaben seine Sendezeit deckt.
+#
+class Airtime:
+    # Flags und Prüfsumme je Frame in Bytes
+    FRAME_OVERHEAD = 4
 
+    # Zuschlag für Bit-Stuffing
+    STUFFING = 1.05
 
-    def send(self, alerts):
-        raise NotImplemented("Für den Treiber '%s' ist keine Alarmierungsroutine implementiert." % self.ttype)
+
+    def __init__(self, config):
+        self.baud       = config.get_int('baud', 1200)
+        self.duty_cycle = config.get_float('duty_cycle', 0.5)
+        self.burst      = config.get_float('burst', 10)
+        self.txdelay    = config.get_float('txdelay', 0.3)
+
+        if self.baud <= 0:
+            raise ConfigException("Ungültiges Attribut 'baud': Wert muss positiv sein.")
+        if not 0 < self.duty_cycle <= 1:
+            raise ConfigException("Ungültiges Attribut 'duty_cycle': Wert muss größer 0 und höchstens 1 sein.")
+        if self.burst <= 0:
+            raise ConfigException("Ungültiges Attribut 'burst': Wert muss positiv sein.")
+        if self.txdelay < 0:
+            raise ConfigException("Ungültiges Attribut 'txdelay': Wert darf nicht negativ sein.")
+
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+
+    def estimate(self, length):
+        return self.txdelay + (length + self.FRAME_OVERHEAD) * 8 * self.STUFFING / self.baud
+
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * self.duty_cycle, self.burst)
+        self.updated = now
+
+
+    #
+    # Wartezeit in Sekunden, bis ein Frame mit der Sendezeit `airtime` gesendet
+    # werden darf. Frames, die länger als `burst` sind, dürfen bei vollem
+    # Guthaben gesendet werden.
+    #
+    def wait(self, airtime):
+        self._refill()
+        return max(min(airtime, self.burst) - self.tokens, 0) / self.duty_cycle
+
+
+    def take(self, airtime):
+        self.tokens -= airtime
 
 
 
@@ -1611,18 +3281,98 @@ class TargetAprsKiss(TargetAprs):
         self.kiss_ports = config_kiss.get_list('ports')
         self.kiss_ports = [ p for p in self.kiss_ports if isinstance(p, int) and p < 16 ]
 
+        self.kiss = KissEncoder(self.kiss_ports)
+
+        # Optional wird die Sendezeit auf dem Funkkanal begrenzt. Frames
+        # warten dann in `outbox` als ( KISS-Daten, Sendezeit ), bis sie
+        # gesendet werden dürfen. Neue Warnungen haben Vorrang vor
+        # Wiederholungen.
+        config_airtime = config.get_subtree('airtime', "Ungültige Sendezeit-Konfiguration für Senke '%s/%s'" % ( self.ttype, self.tname ), True)
+        if len(config_airtime.tree) > 0:
+            self.airtime = Airtime(config_airtime)
+        else:
+            self.airtime = None
+
+        self.outbox_size = config_airtime.get_int('queue_size', 1000)
+        self.outbox_new = collections.deque()
+        self.outbox_repeat = collections.deque()
+
+        if self.outbox_size < 1:
+            raise ConfigException("Ungültiges Attribut 'queue_size': Wert muss positiv sein.")
 
-    def send(self, frames):
-        kissdata = bytes()
 
-        for p in self.kiss_ports:
+    def send(self, frames_new, frames_repeat):
+        for outbox, frames in ( ( self.outbox_new, frames_new ), ( self.outbox_repeat, frames_repeat ) ):
             for f in frames:
-                kissdata += b'\xc0'
-                kissdata += bytes([ 16 * (p % 16) ])
-                kissdata += bytes(f).replace(b'\xdb', b'\xdb\xdd').replace(b'\xc0', b'\xdb\xdc')
-                kissdata += b'\xc0'
+                data = bytes(f)
+                airtime = self.airtime.estimate(len(data)) if self.airtime is not None else 0
+                outbox.append(( self.kiss.encode(data), airtime ))
+
+        # Läuft der Ausgang über, verwerfen wir zunächst Wiederholungen
+        while len(self.outbox_new) + len(self.outbox_repeat) > self.outbox_size:
+            outbox = self.outbox_repeat if self.outbox_repeat else self.outbox_new
+            outbox.popleft()
+            self.logger.warning("Ausgang ist voll. Ältester Frame wird verworfen.")
+
+        # Alle Frames übergeben, für die die Sendezeit ausreicht
+        blocks = []
+        while True:
+            outbox = self.outbox_new if self.outbox_new else self.outbox_repeat
+            if not outbox:
+                break
+
+            kissdata, airtime = outbox[0]
+            if self.airtime is not None:
+                if self.airtime.wait(airtime) > 0:
+                    break
+                self.airtime.take(airtime)
+
+            outbox.popleft()
+            blocks.append(kissdata)
+
+        self.transmit(blocks)
+
+
+    #
+    # Übergibt die KISS-Daten `blocks` an das TNC. Jeder Block enthält einen
+    # Frame für alle KISS-Ports.
+    #
+    def transmit(self, blocks):
+        raise NotImplementedError("Für den Treiber '%s' ist keine Übertragungsroutine implementiert." % self.ttype)
+
+
+    # Sekunden, bis der nächste zurückgehaltene Frame gesendet werden darf
+    def _outbox_wait(self):
+        outbox = self.outbox_new if self.outbox_new else self.outbox_repeat
+        if not outbox:
+            return None
+
+        kissdata, airtime = outbox[0]
+        if self.airtime is None:
+            return 0
+
+        return self.airtime.wait(airtime)
 
-        return kissdata
+
+    def tx_pending(self, t):
+        pending = super().tx_pending(t)
+
+        wait = self._outbox_wait()
+        return pending or ( wait is not None and wait <= 0 )
+
+
+    def tx_next(self):
+        due = super().tx_next()
+
+        wait = self._outbox_wait()
+        if wait is None:
+            return due
+
+        release = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds = wait)
+        if due is None or release < due:
+            return release
+
+        return due
 
 
 
@@ -1641,27 +3391,132 @@ class TargetAprsKissSerial(TargetAprsKiss):
         self.cmd_down      = config_serial.get_bin('cmd_down', '')
         self.cmd_pre       = config_serial.get_bin('cmd_pre', '')
         self.cmd_post      = config_serial.get_bin('cmd_post', '')
+        self.timeout       = config_serial.get_float('timeout', 10)
+        self.reopen_delay  = config_serial.get_float('reopen_delay', 5)
+        self.queue_size    = config_serial.get_int('queue_size', 1000)
+
+        if self.timeout <= 0:
+            raise ConfigException("Ungültiges Attribut 'timeout': Wert muss positiv sein.")
+        if self.reopen_delay <= 0:
+            raise ConfigException("Ungültiges Attribut 'reopen_delay': Wert muss positiv sein.")
+        if self.queue_size < 1:
+            raise ConfigException("Ungültiges Attribut 'queue_size': Wert muss positiv sein.")
 
-        with serial.Serial(self.serial_device, self.serial_baud) as conn:
-            conn.write(self.cmd_up)
+        # Die Schnittstelle bleibt dauerhaft geöffnet. Jedes Öffnen setzt bei
+        # vielen USB-Adaptern DTR/RTS und damit ggf. das TNC zurück. Frames
+        # werden über eine Warteschlange an einen eigenen Thread übergeben,
+        # der sie schreibt und die Schnittstelle bei Bedarf neu öffnet.
+        self.conn = None
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target = self._run, name = 'serial-%s' % self.tname, daemon = True)
+        self.writer.start()
 
 
-    def __del__(self):
-        if hasattr(self, 'cmd_down'):
-            with serial.Serial(self.serial_device, self.serial_baud) as conn:
-                conn.write(self.cmd_down)
+    def _open(self):
+        self.conn = serial.Serial(self.serial_device, self.serial_baud, write_timeout = self.timeout)
+        self.logger.info("Schnittstelle '%s' geöffnet." % self.serial_device)
 
+        # Einmalig je geöffneter Schnittstelle initialisieren
+        self.conn.write(self.cmd_up)
 
-    def send(self, frames):
-        if len(frames) == 0:
+
+    def _close(self):
+        if self.conn is None:
             return
 
-        kissdata = super().send(frames)
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+
+
+    def _write(self, frames):
+        try:
+            if self.conn is None:
+                self._open()
+
+            self.conn.write(self.cmd_pre)
+            for f in frames:
+                self.conn.write(f)
+            self.conn.write(self.cmd_post)
+            self.conn.flush()
+        except Exception as e:
+            # Das Gerät ist ggf. verschwunden, z.B. nach einer Neuanmeldung am
+            # USB. Wir öffnen die Schnittstelle beim nächsten Versuch neu.
+            # Auch andere Fehler, z.B. durch eine ungültige Konfiguration der
+            # Schnittstelle, dürfen den Thread nicht beenden.
+            self.logger.error("Fehler beim Schreiben auf Schnittstelle '%s': %s" % ( self.serial_device, e ))
+            self._close()
+            return False
+
+        return True
+
+
+    def _run(self):
+        # Schnittstelle möglichst schon vor dem ersten Sendezyklus öffnen und
+        # das TNC initialisieren.
+        try:
+            self._open()
+        except Exception as e:
+            self.logger.error("Kann Schnittstelle '%s' nicht öffnen: %s" % ( self.serial_device, e ))
+            self._close()
+
+        frames = []
+        stop = False
+        while not stop:
+            # Auf Frames warten und alle bereits vorliegenden Frames in einem
+            # Sendezyklus zusammenfassen. `None` beendet den Thread.
+            if len(frames) == 0:
+                frames.append(self.queue.get())
+            while True:
+                try:
+                    frames.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in frames:
+                stop = True
+                frames = [ f for f in frames if f is not None ]
+
+            # Solange die Schnittstelle nicht verfügbar ist, halten wir wie in
+            # der Warteschlange höchstens `queue_size` Frames zurück.
+            if len(frames) > self.queue_size:
+                self.logger.warning("Warteschlange für Schnittstelle '%s' ist voll. %d älteste Frame(s) werden verworfen." % ( self.serial_device, len(frames) - self.queue_size ))
+                frames = frames[-self.queue_size:]
+
+            if len(frames) == 0:
+                continue
+
+            if self._write(frames):
+                frames = []
+            elif not stop:
+                time.sleep(self.reopen_delay)
+
+        if self.conn is not None:
+            try:
+                self.conn.write(self.cmd_down)
+                self.conn.flush()
+            except Exception as e:
+                self.logger.error("Fehler beim Schreiben auf Schnittstelle '%s': %s" % ( self.serial_device, e ))
+        self._close()
+
+
+    def transmit(self, blocks):
+        for kissdata in blocks:
+            if self.queue.qsize() >= self.queue_size:
+                try:
+                    self.queue.get_nowait()
+                    self.logger.warning("Warteschlange für Schnittstelle '%s' ist voll. Ältester Frame wird verworfen." % self.serial_device)
+                except queue.Empty:
+                    pass
+
+            self.queue.put(kissdata)
+
 
-        with serial.Serial(self.serial_device, self.serial_baud) as conn:
-            conn.write(self.cmd_pre)
-            conn.write(kissdata)
-            conn.write(self.cmd_post)
+    def close(self):
+        self.queue.put(None)
+        self.writer.join(self.timeout)
 
 
 
@@ -1677,22 +3532,35 @@ class TargetAprsKissTcp(TargetAprsKiss):
         self.remote_host = config_remote.get_str('host')
         self.remote_port = config_remote.get_int('port')
 
+        self.link = TcpLink(self.logger, self.remote_host, self.remote_port, config_remote)
+
+        # Nicht zustellbare Frames werden zurückgehalten und beim nächsten
+        # Sendezyklus erneut gesendet. Läuft die Warteschlange über, werden
+        # die ältesten Frames verworfen.
+        self.queue_size = config_remote.get_int('queue_size', 1000)
+        self.queue = collections.deque()
+
+        if self.queue_size < 1:
+            raise ConfigException("Ungültiges Attribut 'queue_size': Wert muss positiv sein.")
 
-    def send(self, frames):
-        if len(frames) == 0:
+
+    def transmit(self, blocks):
+        for kissdata in blocks:
+            if len(self.queue) >= self.queue_size:
+                self.queue.popleft()
+                self.logger.warning("Warteschlange für TNC '%s:%s' ist voll. Ältester Frame wird verworfen." % ( self.remote_host, self.remote_port ))
+
+            self.queue.append(kissdata)
+
+        if len(self.queue) == 0:
             return
 
-        kissdata = super().send(frames)
+        if not self.link.write(self.queue):
+            self.logger.warning("%d Frame(s) für TNC '%s:%s' werden später erneut gesendet." % ( len(self.queue), self.remote_host, self.remote_port ))
 
-        try:
-            sock = socket.socket()
-            sock.connect(( self.remote_host, self.remote_port ))
-            sock.shutdown(socket.SHUT_RD)
-            sock.send(kissdata)
-            sock.shutdown(socket.SHUT_WR)
-            sock.close()
-        except ConnectionRefusedError:
-            self.logger.error("Kann keine Verbindung zum TNC '%s:%s' aufbauen. Es wird nicht alarmiert." % ( self.remote_host, self.remote_port ))
+
+    def close(self):
+        self.link.close()
 
 
 
@@ -1714,39 +3582,61 @@ class TargetAprsTelnet(TargetAprs):
         if self.remote_pass is not None:
             self.remote_pass = self.remote_pass.replace(" ", "")
 
-
-    def send(self, frames):
-        if len(frames) == 0:
-            return
-
         connectstr = "user %s" % self.remote_user
         if self.remote_pass is not None:
             connectstr += " pass %s" % self.remote_pass
         connectstr += "\r\n"
 
-        try:
-            sock = socket.socket()
-            sock.connect(( self.remote_host, self.remote_port ))
+        self.link = AprsIsLink(self.logger, self.remote_host, self.remote_port, config_remote, connectstr.encode())
 
-            # Anmelden
-            sock.send(connectstr.encode())
+        # Ohne eigene Pakete senden wir in diesem Abstand eine Kommentarzeile,
+        # damit der Server die Verbindung nicht als inaktiv trennt.
+        self.keepalive = config_remote.get_float('keepalive', 120)
+        if self.keepalive <= 0:
+            raise ConfigException("Ungültiges Attribut 'keepalive': Wert muss positiv sein.")
 
-            # Auf Antwort warten.
-            sock.recv(255)
+        # Nicht zustellbare Pakete werden zurückgehalten und beim nächsten
+        # Sendezyklus erneut gesendet.
+        self.queue_size = config_remote.get_int('queue_size', 1000)
+        self.queue = collections.deque()
 
-            # APRS-Pakete senden
-            for f in frames:
-                sock.send(str(f.header).encode())
-                sock.send(b":")
-                sock.send(f.payload)
-                sock.send(b"\r\n")
+        if self.queue_size < 1:
+            raise ConfigException("Ungültiges Attribut 'queue_size': Wert muss positiv sein.")
+
+
+    def send(self, frames_new, frames_repeat):
+        for f in frames_new + frames_repeat:
+            if len(self.queue) >= self.queue_size:
+                self.queue.popleft()
+                self.logger.warning("Warteschlange für APRS-Server '%s:%s' ist voll. Ältestes Paket wird verworfen." % ( self.remote_host, self.remote_port ))
+
+            self.queue.append(str(f.header).encode() + b":" + f.payload + b"\r\n")
+
+        if len(self.queue) == 0 and time.monotonic() - self.link.last_write < self.keepalive:
+            return
+
+        # Alle Pakete in einem Block schreiben
+        if len(self.queue) > 0:
+            chunks = collections.deque([ b''.join(self.queue) ])
+        else:
+            chunks = collections.deque([ b'#keepalive\r\n' ])
+
+        if self.link.write(chunks):
+            self.queue.clear()
+        elif len(self.queue) > 0:
+            self.logger.warning("%d Paket(e) für APRS-Server '%s:%s' werden später erneut gesendet." % ( len(self.queue), self.remote_host, self.remote_port ))
+
+
+    def close(self):
+        self.link.close()
 
-            sock.shutdown(socket.SHUT_RDWR)
-            sock.close()
-        except ConnectionRefusedError:
-            self.logger.error("Kann keine Verbindung zum APRS-Server '%s:%s' aufbauen. Es wird nicht alarmiert." % ( self.remote_host, self.remote_port ))
 
 
+# Nur den CAP-Parser vermessen
+if ARGS.benchmark_cap is not None:
+    benchmark_cap(ARGS.benchmark_cap)
+    sys.exit(0)
+
 
 # Konfiguration einlesen
 with open(ARGS.config) as f:
@@ -1795,6 +3685,7 @@ if log_fallback:
 # Datenstrukturen initialisieren
 GEODATA = Geodata(CONFIG.get_subtree('geodata', "Ungültige Geodaten-Konfiguration", optional = True))
 CACHE = Cache(CONFIG.get_subtree('cache', "Ungültige Cache-Konfiguration"))
+HTTP_STATE = HttpState(CACHE.store.path + '.http', len(CACHE.alerts) > 0)
 
 
 # Quellen initialisieren
@@ -1829,8 +3720,29 @@ for ttype, tclass in TARGET_CLASSES:
         TARGETS.append(tclass(tname, Config(t, "Ungültige Konfiguration für Senke '%s/%s'" % ( ttype, tname ))))
 
 
-# Prüfintervall festlegen
-PERIOD = 60
+# Abrufintervall der Quellen festlegen. Zwischen zwei Abrufen wird die
+# Schleife nur geweckt, wenn bei einer Senke eine Wiederholung fällig ist.
+PERIOD = datetime.timedelta(seconds = 60)
+
+# Quellen werden parallel abgerufen. Ein laufender Abruf wird in
+# `SOURCE_FUTURES` vermerkt, bis er abgeschlossen ist. Die Warnungen werden
+# über `SOURCE_QUEUE` übergeben, sobald sie vorliegen.
+SOURCE_POOL = concurrent.futures.ThreadPoolExecutor(max_workers = max(len(SOURCES), 1), thread_name_prefix = 'source')
+SOURCE_FUTURES = {}
+SOURCE_QUEUE = queue.Queue()
+
+# Quellen, bei denen im laufenden Abruf eine Warnung nicht übernommen werden
+# konnte, und neue HTTP-Validatoren vollständig übernommener Abrufe, die nach
+# dem nächsten Speichern des Caches übernommen werden.
+SOURCE_FAILED = set()
+HTTP_PENDING = {}
+
+# Anstehende Wiederholungen für Warnungen aus dem Cache vormerken
+for alert in CACHE.query():
+    for t in TARGETS:
+        t.tx_schedule(alert)
+
+T_POLL = datetime.datetime.now(datetime.UTC)
 
 # Hauptschleife
 while True:
@@ -1838,38 +3750,130 @@ while True:
         # Zeit bestimmen
         t1 = datetime.datetime.now(datetime.UTC)
 
+        # Quellen nur abrufen, wenn das Abrufintervall erreicht ist. Sonst
+        # wurden wir für eine fällige Wiederholung geweckt.
+        poll = t1 >= T_POLL
+
         LOGGER.debug("Alarmierungsschleife beginnt.")
 
-        # Alle Quellen abrufen
-        for s in SOURCES:
-            try:
-                for alert in s.fetch():
-                    CACHE.update(alert)
-            except Exception as e:
-                LOGGER.error("Fehler beim Abfragen der Quelle '%s'" % s.stype)
-                LOGGER.exception(e)
+        if poll:
+            # Alle Quellen abrufen. Hängt ein Abruf aus einem vorherigen
+            # Durchlauf noch, starten wir keinen weiteren.
+            for s in SOURCES:
+                if s not in SOURCE_FUTURES:
+                    SOURCE_FUTURES[s] = SOURCE_POOL.submit(s.poll, SOURCE_QUEUE)
+
+            # Warnungen übernehmen, sobald sie vorliegen, bis alle Abrufe
+            # abgeschlossen sind. Quellen, die ihr Zeitlimit überschreiten,
+            # werden in diesem Durchlauf übergangen. Ihre übrigen Warnungen
+            # werden im nächsten Durchlauf übernommen. Die Zeit, die die
+            # Senken für die sofortige Alarmierung benötigen, wird nicht auf
+            # die Zeitlimits angerechnet. Sonst könnte z.B. ein
+            # Verbindungsaufbau einer Senke dazu führen, dass andere Quellen
+            # übergangen werden.
+            t_dispatch = datetime.timedelta()
+            while True:
+                elapsed = (datetime.datetime.now(datetime.UTC) - t1 - t_dispatch).total_seconds()
+                deadlines = [ s.deadline for s in SOURCE_FUTURES if s.deadline > elapsed ]
+                if len(deadlines) == 0:
+                    break
+
+                try:
+                    results = [ SOURCE_QUEUE.get(timeout = min(deadlines) - elapsed) ]
+                except queue.Empty:
+                    continue
+
+                while True:
+                    try:
+                        results.append(SOURCE_QUEUE.get_nowait())
+                    except queue.Empty:
+                        break
+
+                for s, alert in results:
+                    if alert is None:
+                        # Abruf abgeschlossen. Die Validatoren übernehmen wir
+                        # nur, wenn alle Warnungen übernommen wurden.
+                        try:
+                            staged = SOURCE_FUTURES.pop(s).result()
+                            if s not in SOURCE_FAILED:
+                                HTTP_PENDING.update(staged)
+                        except Exception as e:
+                            LOGGER.error("Fehler beim Abfragen der Quelle '%s'" % s.stype)
+                            LOGGER.exception(e)
+                        SOURCE_FAILED.discard(s)
+                        continue
 
+                    try:
+                        CACHE.update(alert)
+                        s.merged(alert)
+                    except Exception as e:
+                        LOGGER.error("Fehler beim Übernehmen der Warnung '%s' der Quelle '%s/%s'" % ( alert.aid, s.stype, s.sname ))
+                        LOGGER.exception(e)
+                        SOURCE_FAILED.add(s)
+
+                # Neue Warnungen sofort alarmieren, ohne auf die übrigen
+                # Quellen zu warten. Wiederholungen erfolgen danach wie
+                # gewohnt nach dem Wiederholungsrhythmus.
+                try:
+                    CACHE.persistent_ids()
+                    fresh = CACHE.query_fresh()
+                except Exception as e:
+                    LOGGER.error("Fehler bei der Verarbeitung neuer Warnungen")
+                    LOGGER.exception(e)
+                    fresh = []
+
+                if len(fresh) > 0:
+                    LOGGER.info("Alarmiere %d neue Warnung(en) sofort." % len(fresh))
+
+                    t_start = datetime.datetime.now(datetime.UTC)
+                    for t in TARGETS:
+                        try:
+                            t.alert(fresh)
+                        except Exception as e:
+                            LOGGER.error("Fehler bei der Alarmierung über Senke '%s/%s'" % ( t.ttype, t.tname ))
+                            LOGGER.exception(e)
+                    t_dispatch += datetime.datetime.now(datetime.UTC) - t_start
+
+            for s in SOURCES:
+                if s in SOURCE_FUTURES:
+                    LOGGER.warning("Quelle '%s/%s' hat das Zeitlimit überschritten und wird in diesem Durchlauf übergangen." % ( s.stype, s.sname ))
+
+        valid = None
+        alerts = None
         try:
-            # Veraltete Warnungen löschen
-            valid = CACHE.purge()
+            if poll:
+                # Veraltete Warnungen löschen
+                valid = CACHE.purge()
 
-            # IDs vergeben
-            CACHE.persistent_ids()
+                # IDs vergeben
+                CACHE.persistent_ids()
 
             # Zu alarmierende Warnungen abfragen
             alerts = CACHE.query()
         except Exception as e:
             LOGGER.error("Fehler bei der Verarbeitung aktueller Warnungen")
             LOGGER.exception(e)
-            continue
 
-        # Alarmierung vornehmen
+        # Alarmierung vornehmen. Ohne neuen Abruf der Quellen kommen nur
+        # Senken mit fälligen Wiederholungen zum Zug. Diese gehen nicht
+        # verloren, wenn die Abfrage oder die Alarmierung fehlschlägt, sondern
+        # werden nach kurzer Wartezeit erneut versucht.
         for t in TARGETS:
+            now = datetime.datetime.now(datetime.UTC)
+            if not (poll or t.tx_pending(now)):
+                continue
+
+            due = t.tx_take(now)
+            if alerts is None:
+                t.tx_retry(due, now)
+                continue
+
             try:
                 t.alert(alerts)
             except Exception as e:
                 LOGGER.error("Fehler bei der Alarmierung über Senke '%s/%s'" % ( t.ttype, t.tname ))
                 LOGGER.exception(e)
+                t.tx_retry(due, now)
 
         try:
             # Cache aktualisieren
@@ -1877,9 +3881,21 @@ while True:
         except Exception as e:
             LOGGER.error("Fehler beim Aufräumen des Caches")
             LOGGER.exception(e)
+        else:
+            # Erst jetzt sind die abgerufenen Warnungen gesichert
+            try:
+                HTTP_STATE.update(HTTP_PENDING)
+                HTTP_PENDING.clear()
+            except Exception as e:
+                LOGGER.error("Fehler beim Speichern des HTTP-Zustands")
+                LOGGER.exception(e)
 
-        # Temporäre Daten der Quellen aufräumen
+        # Temporäre Daten der Quellen aufräumen. Quellen, deren Abruf noch
+        # läuft, lassen wir dabei aus.
         for s in SOURCES:
+            if valid is None or s in SOURCE_FUTURES:
+                continue
+
             try:
                 s.purge(valid)
             except Exception as e:
@@ -1891,9 +3907,24 @@ while True:
         # Zeit bestimmen
         t2 = datetime.datetime.now(datetime.UTC)
 
-        # Wartezeit ausrechnen, sodass wir die Schleife in passender Phasenlage
-        # zu `t1` wieder beginnen.
-        time.sleep((t1 - t2).total_seconds() % PERIOD)
+        # Nächsten Abruf in passender Phasenlage zum vorherigen festlegen.
+        # Verpasste Abrufe werden übersprungen.
+        if poll:
+            T_POLL += ((t2 - T_POLL) // PERIOD + 1) * PERIOD
+
+        # Bis zum nächsten Abruf oder zur nächsten fälligen Wiederholung
+        # warten, je nachdem, was früher eintritt.
+        wakeup = min([ T_POLL ] + [ due for due in ( t.tx_next() for t in TARGETS ) if due is not None ])
+        time.sleep(max((wakeup - t2).total_seconds(), 0))
 
     except KeyboardInterrupt:
         break
+
+SOURCE_POOL.shutdown(wait = False, cancel_futures = True)
+
+for t in TARGETS:
+    try:
+        t.close()
+    except Exception as e:
+        LOGGER.error("Fehler beim Beenden der Senke '%s/%s'" % ( t.ttype, t.tname ))
+        LOGGER.exception(e)